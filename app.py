@@ -1,11 +1,74 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+from io import BytesIO
 import streamlit as st
 import preprocessor  # Assuming this is your custom preprocessing module
 import helper  # Assuming this is your custom helper module
+import cache
+import profiling
+import scheduler
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 import traceback  # Import traceback module for exception handling
 
+# Points drawn in the daily timeline; longer chats are summed into weeks, months or years
+DAILY_TIMELINE_POINTS = 500
+
+
+@st.cache_resource
+def get_result_cache():
+    # One cache shared by every session; set WCA_CACHE_DIR to also persist entries on disk, and
+    # WCA_CACHE_MAX_BYTES to change the memory budget (parsed chats take about 1.1x the export's size)
+    return cache.ResultCache(max_bytes=int(os.environ.get('WCA_CACHE_MAX_BYTES', cache.MAX_BYTES)),
+                             directory=os.environ.get('WCA_CACHE_DIR'))
+
+
+@st.cache_resource
+def get_scheduler():
+    # Analyses of every session run on one thread pool and land in the shared result cache
+    return scheduler.AnalysisScheduler(get_result_cache())
+
+
+def load_chat(uploaded_file, previous=None):
+    # Re-uploads of a chat seen before only parse the messages added since the last upload
+    state = preprocessor.ingest(uploaded_file, previous, compact=True)
+
+    # Links and media are classified once here, only for the rows this upload added
+    helper.classify_messages(state['df'], state['added'])
+
+    # Aggregate and tokenize once so the per-user helpers don't rescan every message
+    if state['added']:
+        added = state['df'].iloc[state['added']:]
+        state['cube'] = helper.update_cube(previous['cube'], added, state['removed'])
+        state['words'] = helper.update_word_counts(previous['words'], added, state['removed'])
+        state['emojis'] = helper.update_emoji_counts(previous['emojis'], added, state['removed'])
+    else:
+        state['cube'] = helper.build_cube(state['df'])
+        state['words'] = helper.count_words(state['df'])
+        state['emojis'] = helper.count_emojis(state['df'])
+    return state
+
+
+def figure_png(fig):
+    # Figures are rendered once to PNG and closed, so cached charts don't keep matplotlib state alive
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def show_png(png, name):
+    # Rendering is timed as its own stage, separately from the analysis behind the figure
+    with profiling.stage('render ' + name):
+        st.image(png)
+
+
+def section(label):
+    # Collapsed section whose contents are only computed once the user opens it
+    return st.expander(label, key='section_' + label, on_change='rerun')
+
+
 # Function to create the Streamlit application
 def main():
     # Set the title for the Streamlit sidebar
@@ -14,140 +77,296 @@ def main():
     # File uploader to upload WhatsApp chat data
     uploaded_file = st.sidebar.file_uploader('Choose a File')
 
+    # Timings of every stage of this run; WCA_SAMPLE_PROFILER=1 turns the sampling profiler on by default
+    performance = st.sidebar.expander('Performance')
+    sample = performance.checkbox('Sampling profiler', value=os.environ.get('WCA_SAMPLE_PROFILER') == '1')
+
+    # Busy analysis workers are sampled too, since the script thread mostly waits for them
+    with profiling.Profiler(sample=sample, threads=get_scheduler().active_threads) as profiler:
+        if uploaded_file is not None:
+            analyze(uploaded_file)
+
+    performance.dataframe(profiler.report(), hide_index=True)
+    if profiler.sampler is not None:
+        performance.dataframe(profiler.sampler.top(), hide_index=True)
+
+
+# Function to run the analysis of an uploaded chat
+def analyze(uploaded_file):
+    try:
+        # Parsed chats and analysis results are cached under a hash of the uploaded bytes
+        results = get_result_cache()
+        with profiling.stage('hash upload', len(uploaded_file.getbuffer())):
+            digest = cache.content_key(uploaded_file.getbuffer())
+        def load():
+            # The latest ingestion of each export name is kept to parse the next upload incrementally.
+            # Only its bookkeeping is stored; the frame and aggregates are taken from the chat entry
+            # it refers to, so they aren't cached twice. Both are pinned, so a large chat or a burst
+            # of analysis results can't evict what the next upload needs
+            previous = None
+            ingestion = results.get(('ingestion', uploaded_file.name))
+            if ingestion is not None:
+                chat = results.get((ingestion['chat'], 'chat'))
+                if chat is not None:
+                    previous = dict(ingestion, df=chat[0], cube=chat[1], words=chat[2], emojis=chat[3])
+
+            state = load_chat(uploaded_file, previous)
+            chat = results.put((digest, 'chat'), (state['df'], state['cube'], state['words'], state['emojis']),
+                               pin=True)
+            results.put(('ingestion', uploaded_file.name),
+                        {'chat': digest, 'offset': state['offset'], 'digest': state['digest'],
+                         'last_date': state['last_date'], 'tail_rows': state['tail_rows']}, pin=True)
+            if ingestion is not None and ingestion['chat'] != digest:
+                results.unpin((ingestion['chat'], 'chat'))
+            return chat
+
+        chat = results.get((digest, 'chat'))
+        if chat is None:
+            chat = load()
+        df, cube, word_counts, emoji_counts = chat
+
+        # Get unique users from the DataFrame
+        user_list = df['user'].unique().tolist()
+        user_list.sort()
+        user_list.insert(0, 'Overall')
+
+        # Select a user to show analysis for
+        selected_user = st.sidebar.selectbox('Show Analysis w.r.t', user_list)
+
+        # Restrict the analyses to a range of days; the ends of the slider mean no bound
+        start = end = None
+        dates = helper.time_index(df)
+        if len(dates) and dates.iloc[0].date() < dates.iloc[-1].date():
+            first, last = dates.iloc[0].date(), dates.iloc[-1].date()
+            low, high = st.sidebar.slider('Date range', min_value=first, max_value=last, value=(first, last))
+            if low > first:
+                start = pd.Timestamp(low)
+            if high < last:
+                end = pd.Timestamp(high) + pd.Timedelta(days=1)
+
+        # Results are cached per chat, user and date range
+        scope = (digest, selected_user, start, end)
 
-    if uploaded_file is not None:
-        # Read and decode the uploaded file data
-        bytes_data = uploaded_file.getvalue()
-        data = bytes_data.decode('utf-8')
+        def cached(name, compute):
+            return results.get_or_compute(scope + (name,), compute)
 
-        try:
-            # Preprocess the data using a custom function (prepocessor.preprocess assumed to be defined)
-            df = preprocessor.preprocess(data)
+        def figure(name, draw):
+            # Draws the figure on first use and keeps only its PNG
+            def compute():
+                with profiling.stage('draw ' + name):
+                    return figure_png(draw())
+            return cached(('figure', name), compute)
 
-            # Get unique users from the DataFrame
-            user_list = df['user'].unique().tolist()
-            user_list.sort()
-            user_list.insert(0, 'Overall')
+        # The analyses are independent, so they all start in the background as soon as the chat
+        # is parsed and a user is selected, before the button is even pressed
+        jobs = {
+            'fetch_stats': lambda: helper.fetch_stats(selected_user, df, cube, start, end),
+            'monthly_timeline': lambda: helper.monthly_timeline(selected_user, df, cube, start, end),
+            'daily_timeline': lambda: helper.daily_timeline(
+                selected_user, df, cube, DAILY_TIMELINE_POINTS, start, end),
+            'week_activity_map': lambda: helper.week_activity_map(selected_user, df, cube, start, end),
+            'monthly_activity_map': lambda: helper.monthly_activity_map(selected_user, df, cube, start, end),
+            'activity_heatmap': lambda: helper.activity_heatmap(selected_user, df, cube, start, end),
+            ('wordcloud_png', 500, 500): lambda: helper.wordcloud_png(
+                selected_user, df, word_counts, 500, 500, start, end),
+            'most_common_words': lambda: helper.most_common_words(selected_user, df, word_counts, start, end),
+            'emoji_analyzer': lambda: helper.emoji_analyzer(selected_user, df, emoji_counts, start, end),
+        }
+        if selected_user == 'Overall':
+            jobs['most_active_users'] = lambda: helper.most_active_users(df, start, end)
+            jobs['compare_users'] = lambda: helper.compare_users(df, cube, emoji_counts, start, end)
 
-            # Select a user to show analysis for
-            selected_user = st.sidebar.selectbox('Show Analysis w.r.t', user_list)
+        pool = get_scheduler()
+        previous = st.session_state.get('analysis')
+        if previous is not None and previous[0] != scope:
+            # Work still queued for the previously selected chat, user or range is dropped
+            pool.cancel(previous[1].values())
+        futures = {name: pool.submit(scope + (name,), compute) for name, compute in jobs.items()}
+        st.session_state['analysis'] = (scope, futures)
 
-            # Button to trigger analysis
-            if st.sidebar.button('Show Analysis'):
-                # Fetch statistics based on selected user
-                num_messages, words, num_media_messages, num_links = helper.fetch_stats(selected_user, df)
+        # Button to trigger analysis; remembered so opening a section doesn't hide the dashboard
+        if st.sidebar.button('Show Analysis'):
+            st.session_state['show_analysis'] = True
+
+        if st.session_state.get('show_analysis'):
+            try:
+                # Every visible section gets a placeholder first and is filled once its analysis is done.
+                # Figures are drawn here on the script thread, since pyplot is not thread-safe
+                renders = {}
+
+                def fill(name, container, render):
+                    placeholder = container.empty()
+                    placeholder.caption('Computing...')
+                    renders[name] = (placeholder, render)
 
                 # Display top statistics
                 st.title('Top Statistics')
-                col1, col2, col3, col4 = st.columns(4)
 
-                with col1:
-                    st.header('Total Messages')
-                    st.title(num_messages)
+                def render_stats(stats):
+                    num_messages, words, num_media_messages, num_links = stats
+                    col1, col2, col3, col4 = st.columns(4)
 
-                with col2:
-                    st.header('Total Words')
-                    st.title(words)
+                    with col1:
+                        st.header('Total Messages')
+                        st.title(num_messages)
 
-                with col3:
-                    st.header('Media Shared')
-                    st.title(num_media_messages)
+                    with col2:
+                        st.header('Total Words')
+                        st.title(words)
 
-                with col4:
-                    st.header('Links Shared')
-                    st.title(num_links)
+                    with col3:
+                        st.header('Media Shared')
+                        st.title(num_media_messages)
+
+                    with col4:
+                        st.header('Links Shared')
+                        st.title(num_links)
+
+                fill('fetch_stats', st, render_stats)
 
                 # Display monthly timeline of messages
-                st.title('Monthly Timeline')
-                try:
-                    timeline = helper.monthly_timeline(selected_user, df)
-                    fig, ax = plt.subplots()
-                    ax.plot(timeline['time'], timeline['message'])
-                    plt.xticks(rotation='vertical')
-                    plt.tight_layout()
-                    st.pyplot(fig)
-
-                    # Display daily timeline of messages
-                    st.title('Daily Timeline')
-                    daily_timeline = helper.daily_timeline(selected_user, df)
-                    fig, ax = plt.subplots()
-                    ax.plot(daily_timeline['date'], daily_timeline['message'], color='green')
-                    plt.xticks(rotation='vertical')
-                    plt.tight_layout()
-                    st.pyplot(fig)
-
-                    # Display activity map
-                    st.title('Activity Map')
-                    col1, col2 = st.columns(2)
+                monthly = section('Monthly Timeline')
+                if monthly.open:
+                    def render_monthly(timeline):
+                        def draw():
+                            fig, ax = plt.subplots()
+                            ax.plot(timeline['time'], timeline['message'])
+                            plt.xticks(rotation='vertical')
+                            plt.tight_layout()
+                            return fig
+                        show_png(figure('monthly timeline', draw), 'monthly timeline')
+                    fill('monthly_timeline', monthly, render_monthly)
 
-                    with col1:
-                        st.header('Most Busy Day')
-                        busy_day = helper.week_activity_map(selected_user, df)
-                        fig, ax = plt.subplots()
-                        ax.bar(busy_day.index, busy_day.values, color='brown')
-                        plt.tight_layout()
-                        st.pyplot(fig)
+                # Display daily timeline of messages
+                daily = section('Daily Timeline')
+                if daily.open:
+                    def render_daily(daily_timeline):
+                        def draw():
+                            fig, ax = plt.subplots()
+                            ax.plot(daily_timeline['date'], daily_timeline['message'], color='green')
+                            # Date ticks are placed automatically instead of one label per point
+                            fig.autofmt_xdate(rotation=90)
+                            plt.tight_layout()
+                            return fig
+                        show_png(figure('daily timeline', draw), 'daily timeline')
+                    fill('daily_timeline', daily, render_daily)
 
-                    with col2:
-                        st.header('Most Busy Month')
-                        busy_month = helper.monthly_activity_map(selected_user, df)
-                        fig, ax = plt.subplots()
-                        ax.bar(busy_month.index, busy_month.values, color='orange')
-                        plt.xticks(rotation='vertical')
-                        plt.tight_layout()
-                        st.pyplot(fig)
-
-                    # Display weekly activity heatmap
-                    st.title('Weekly Activity Map')
-                    user_heatmap = helper.activity_heatmap(selected_user, df)
-                    fig, ax = plt.subplots()
-                    sns.heatmap(user_heatmap, ax=ax)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-
-                    if selected_user == 'Overall':
-                        # Display most active users if overall analysis is selected
-                        st.title('Most Active Users')
-                        x, new_df = helper.most_active_users(df)
-                        fig, ax = plt.subplots()
-
-                        col1, col2 = st.columns(2)
-
-                        with col1:
-                            colors = ['black', 'blue', 'brown', 'green', 'yellow']
-                            ax.bar(x.index, x.values, color=colors)
+                # Display activity map
+                activity = section('Activity Map')
+                if activity.open:
+                    def render_day(busy_day):
+                        def draw():
+                            fig, ax = plt.subplots()
+                            ax.bar(busy_day.index, busy_day.values, color='brown')
+                            plt.tight_layout()
+                            return fig
+                        show_png(figure('busy day', draw), 'busy day')
+
+                    def render_month(busy_month):
+                        def draw():
+                            fig, ax = plt.subplots()
+                            ax.bar(busy_month.index, busy_month.values, color='orange')
                             plt.xticks(rotation='vertical')
-                            st.pyplot(fig)
-
-                        with col2:
-                            st.dataframe(new_df)
-
-                    # Display word cloud for selected user
-                    st.title('WORDCLOUD')
-                    df_wc = helper.create_wordcloud(selected_user, df)
-                    fig, ax = plt.subplots()
-                    ax.imshow(df_wc)
-                    st.pyplot(fig)
-
-                    # Display most common words
-                    most_common_df = helper.most_common_words(selected_user, df)
-                    fig, ax = plt.subplots()
-                    ax.barh(most_common_df['Word'], most_common_df['Frequency'])
-                    plt.xticks(rotation='vertical')
-                    st.title('Most Common Words')
-                    st.pyplot(fig)
-
-                    st.dataframe(most_common_df)
-
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
-                    # Print traceback for debugging
-                    traceback.print_exc()
-
-        except Exception as e:
-            st.error(f"Error during preprocessing: {e}")
-            # Print traceback for debugging
-            traceback.print_exc()
+                            plt.tight_layout()
+                            return fig
+                        show_png(figure('busy month', draw), 'busy month')
+
+                    col1, col2 = activity.columns(2)
+                    col1.header('Most Busy Day')
+                    fill('week_activity_map', col1, render_day)
+                    col2.header('Most Busy Month')
+                    fill('monthly_activity_map', col2, render_month)
+
+                # Display weekly activity heatmap
+                heatmap = section('Weekly Activity Map')
+                if heatmap.open:
+                    def render_heatmap(user_heatmap):
+                        def draw():
+                            fig, ax = plt.subplots()
+                            sns.heatmap(user_heatmap, ax=ax)
+                            plt.tight_layout()
+                            return fig
+                        show_png(figure('activity heatmap', draw), 'activity heatmap')
+                    fill('activity_heatmap', heatmap, render_heatmap)
+
+                if selected_user == 'Overall':
+                    # Display most active users if overall analysis is selected
+                    active = section('Most Active Users')
+                    if active.open:
+                        def render_active(result):
+                            x, new_df = result
+
+                            def draw():
+                                fig, ax = plt.subplots()
+                                colors = ['black', 'blue', 'brown', 'green', 'yellow']
+                                ax.bar(x.index, x.values, color=colors)
+                                plt.xticks(rotation='vertical')
+                                return fig
+
+                            col1, col2 = st.columns(2)
+
+                            with col1:
+                                show_png(figure('most active users', draw), 'most active users')
+
+                            with col2:
+                                st.dataframe(new_df)
+                        fill('most_active_users', active, render_active)
+
+                    # Display every member side by side, computed in one pass over the chat
+                    comparison = section('Compare Users')
+                    if comparison.open:
+                        fill('compare_users', comparison, lambda table: st.dataframe(table, hide_index=True))
+
+                # Display word cloud for selected user
+                cloud = section('WORDCLOUD')
+                if cloud.open:
+                    # The rendered image is cached per chat, user and size since its layout never changes
+                    def render_cloud(wordcloud):
+                        if wordcloud is not None:
+                            show_png(wordcloud, 'wordcloud')
+                    fill(('wordcloud_png', 500, 500), cloud, render_cloud)
+
+                # Display most common words
+                common = section('Most Common Words')
+                if common.open:
+                    def render_common(most_common_df):
+                        def draw():
+                            fig, ax = plt.subplots()
+                            ax.barh(most_common_df['Word'], most_common_df['Frequency'])
+                            plt.xticks(rotation='vertical')
+                            return fig
+                        show_png(figure('most common words', draw), 'most common words')
+                        st.dataframe(most_common_df)
+                    fill('most_common_words', common, render_common)
+
+                # Display emoji usage
+                emojis = section('Emoji Analysis')
+                if emojis.open:
+                    fill('emoji_analyzer', emojis, st.dataframe)
+
+                # Fill the sections in the order their analyses finish rather than the order they're laid out
+                pending = {futures[name]: name for name in renders}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = pending.pop(future)
+                        if future.cancelled():
+                            # Another session on the same chat, user and range moved on; schedule it again
+                            pending[pool.submit(scope + (name,), jobs[name])] = name
+                            continue
+                        placeholder, render = renders[name]
+                        with placeholder.container():
+                            render(future.result())
+
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+                # Print traceback for debugging
+                traceback.print_exc()
+
+    except Exception as e:
+        st.error(f"Error during preprocessing: {e}")
+        # Print traceback for debugging
+        traceback.print_exc()
 
 # Entry point of the application
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+import preprocessor
+import helper
+import synthetic
+
+
+def measure(function, repeat=3):
+    """
+    Times a function and measures its peak Python memory allocation.
+
+    The best of `repeat` untraced runs is reported as the time, and one extra run under
+    tracemalloc gives the peak, so tracing overhead doesn't skew the timings.
+
+    Parameters:
+    - function (callable): Function called without arguments.
+    - repeat (int): Number of timed runs.
+
+    Returns:
+    - dict: 'time' in seconds and 'peak' in bytes.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'time': best, 'peak': peak}
+
+
+def cases(data, user='Overall'):
+    # Benchmarked stages, in the order the app runs them; later cases use the results of earlier ones
+    df = preprocessor.preprocess(data, compact=True)
+    helper.classify_messages(df)
+    cube = helper.build_cube(df)
+    word_counts = helper.count_words(df)
+    emoji_counts = helper.count_emojis(df)
+    middle = df['message_date'].iloc[len(df) // 2] if len(df) else pd.Timestamp(0)
+    raw = data.encode('utf-8')
+    workers = max(2, os.cpu_count() or 1)
+
+    return {
+        'preprocess': lambda: preprocessor.preprocess(data),
+        'preprocess_compact': lambda: preprocessor.preprocess(data, compact=True),
+        # Forced onto the process pool at every size and core count, pool start-up included
+        'preprocess_parallel': lambda: preprocessor.preprocess_parallel(raw, workers, min_size=0),
+        'classify_messages': lambda: helper.classify_messages(df.copy()),
+        'build_cube': lambda: helper.build_cube(df),
+        'count_words': lambda: helper.count_words(df),
+        'count_emojis': lambda: helper.count_emojis(df),
+        'fetch_stats': lambda: helper.fetch_stats(user, df, cube),
+        'monthly_timeline': lambda: helper.monthly_timeline(user, df, cube),
+        'daily_timeline': lambda: helper.daily_timeline(user, df, cube),
+        'week_activity_map': lambda: helper.week_activity_map(user, df, cube),
+        'monthly_activity_map': lambda: helper.monthly_activity_map(user, df, cube),
+        'activity_heatmap': lambda: helper.activity_heatmap(user, df, cube),
+        'most_active_users': lambda: helper.most_active_users(df),
+        'compare_users': lambda: helper.compare_users(df, cube, emoji_counts),
+        'most_common_words': lambda: helper.most_common_words(user, df, word_counts),
+        'emoji_analyzer': lambda: helper.emoji_analyzer(user, df, emoji_counts),
+        'time_slice': lambda: helper.time_slice(df, middle, middle + pd.Timedelta(days=30)),
+        'wordcloud_png': lambda: helper.wordcloud_png(user, df, word_counts),
+    }
+
+
+def run(messages, formats, users, repeat, seed):
+    # Results keyed by '<format>/<messages>/<case>'
+    results = {}
+    for fmt in formats:
+        data = synthetic.generate_chat(messages, users=users, fmt=fmt, seed=seed)
+        for name, function in cases(data).items():
+            key = f'{fmt}/{messages}/{name}'
+            results[key] = measure(function, repeat)
+            print(f"{key:50s} {results[key]['time'] * 1000:10.1f} ms {results[key]['peak'] / 2 ** 20:10.1f} MiB")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with a stored baseline.
+
+    Parameters:
+    - results (dict): Output of run.
+    - baseline (dict): Earlier output of run.
+    - threshold (float): Ratio to the baseline above which a case counts as a regression.
+
+    Returns:
+    - list of str: Descriptions of the regressions found.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in ('time', 'peak'):
+            ratio = result[metric] / baseline[key][metric] if baseline[key][metric] else 1.0
+            if ratio > threshold:
+                regressions.append(f'{key} {metric}: {ratio:.2f}x baseline')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing and analysis on synthetic chat exports.')
+    parser.add_argument('--messages', type=int, nargs='+', default=[10000])
+    parser.add_argument('--formats', nargs='+', choices=sorted(synthetic.HEADERS), default=sorted(synthetic.HEADERS))
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='Baseline file to compare against')
+    parser.add_argument('--save', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    results = {}
+    for messages in args.messages:
+        results.update(run(messages, args.formats, args.users, args.repeat, args.seed))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+logger = logging.getLogger('whatsapp_chat_analyzer.cache')
+
+# Default memory budget of a ResultCache
+MAX_BYTES = 512 * 1024 * 1024
+
+
+def content_key(data):
+    """
+    Hashes the raw bytes of an upload so identical exports share cache entries.
+
+    Parameters:
+    - data (bytes or memoryview): Raw contents of the uploaded file.
+
+    Returns:
+    - str: Hex SHA-256 digest of the contents.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def sizeof(value):
+    # Approximate memory footprint of a cached value in bytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum()) if isinstance(value, pd.DataFrame) \
+            else int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache for parsed chats and analysis results.
+
+    Entries are evicted least recently used first once either the entry count or the total
+    estimated size goes over its limit. An entry larger than the whole size limit is not kept
+    in memory at all, since it would only push out every other entry and then itself. When a
+    directory is given, every entry is also pickled to disk and reloaded from there after it
+    has been evicted or the app restarted.
+
+    Pinned entries (see put) are never evicted, whatever their size, until they are unpinned.
+
+    Parameters:
+    - max_entries (int): Maximum number of entries kept in memory.
+    - max_bytes (int): Maximum total estimated size of the entries kept in memory.
+    - directory (str, optional): Directory used to persist entries; disabled when None.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=MAX_BYTES, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (self.directory is not None and os.path.exists(self._path(key)))
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + '.pkl')
+
+    def _store(self, key, value, size):
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        if size > self.max_bytes and key not in self._pinned:
+            logger.warning('Not caching %r in memory: its estimated size of %.1f MiB is over the limit of %.1f MiB',
+                           key, size / 2 ** 20, self.max_bytes / 2 ** 20)
+            return
+        self._entries[key] = (value, size)
+        self.nbytes += size
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        # Least recently used first, skipping pinned entries and the one just stored
+        for old in list(self._entries):
+            if len(self._entries) <= self.max_entries and self.nbytes <= self.max_bytes:
+                break
+            if old != keep and old not in self._pinned:
+                self.nbytes -= self._entries.pop(old)[1]
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return default
+
+        with open(self._path(key), 'rb') as f:
+            value = pickle.load(f)
+        with self._lock:
+            self._store(key, value, sizeof(value))
+        return value
+
+    def put(self, key, value, pin=False):
+        """
+        Stores a value, also on disk when the cache has a directory.
+
+        Parameters:
+        - key (hashable): Cache key.
+        - value: Value to store.
+        - pin (bool): Keep the entry in memory until unpin is called, e.g. for the state needed to
+          ingest the next upload of a chat incrementally.
+
+        Returns:
+        - The value.
+        """
+        size = sizeof(value)
+        with self._lock:
+            if pin:
+                self._pinned.add(key)
+            self._store(key, value, size)
+
+        if self.directory is not None:
+            # Write to a temporary file of this writer's own first, so a crash never leaves a
+            # truncated entry behind and concurrent writers of the same key don't collide
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp, self._path(key))
+            except BaseException:
+                os.remove(temp)
+                raise
+        return value
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for key, computing and storing it on a miss.
+
+        Parameters:
+        - key (hashable): Cache key, e.g. (content hash, selected user, analysis name).
+        - compute (callable): Function called without arguments to produce the value.
+
+        Returns:
+        - The cached or freshly computed value.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = self.put(key, compute())
+        return value
+
+    def unpin(self, key):
+        # Makes a pinned entry evictable again
+        with self._lock:
+            self._pinned.discard(key)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._pinned.clear()
+            self._entries.clear()
+            self.nbytes = 0
@@ -0,0 +1,234 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import preprocessor
+import helper
+
+
+def find_exports(patterns):
+    """
+    Expands directories and glob patterns into the list of chat exports to analyse.
+
+    Parameters:
+    - patterns (list of str): Directories (all .txt files inside are used) or glob patterns.
+
+    Returns:
+    - list of str: Sorted, de-duplicated file paths.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.txt')
+        paths.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(paths)
+
+
+def safe_name(name):
+    # File-system friendly version of a chat or user name
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'chat'
+
+
+def export_names(paths):
+    """
+    Names the outputs of each export after its path relative to the folder all exports share,
+    so that e.g. a/_chat.txt and b/_chat.txt don't overwrite each other's results.
+
+    Parameters:
+    - paths (list of str): Chat exports, as returned by find_exports.
+
+    Returns:
+    - dict of str to str: File-system friendly output name of every path.
+    """
+    if not paths:
+        return {}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    return {path: safe_name(os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0]) for path in paths}
+
+
+def analysis_tables(df, users, word_counts=None):
+    """
+    Runs the helper analyses for each user and collects the results as tidy tables.
+
+    Parameters:
+    - df (pd.DataFrame): Preprocessed chat.
+    - users (list of str): Users to analyse; 'Overall' covers the whole chat.
+    - word_counts (pd.Series, optional): Precomputed word counts from helper.count_words.
+
+    Returns:
+    - dict of str to pd.DataFrame: One table per analysis, each with a 'user' column.
+    """
+    helper.classify_messages(df)
+    cube = helper.build_cube(df)
+    if word_counts is None:
+        word_counts = helper.count_words(df)
+    emoji_counts = helper.count_emojis(df)
+
+    tables = {name: [] for name in ('stats', 'monthly_timeline', 'daily_timeline', 'week_activity',
+                                    'month_activity', 'activity_heatmap', 'most_common_words', 'emojis')}
+    for user in users:
+        num_messages, words, num_media_messages, num_links = helper.fetch_stats(user, df, cube)
+        tables['stats'].append(pd.DataFrame([{'messages': num_messages, 'words': words,
+                                              'media': num_media_messages, 'links': num_links}]))
+        tables['monthly_timeline'].append(helper.monthly_timeline(user, df, cube))
+        tables['daily_timeline'].append(helper.daily_timeline(user, df, cube))
+        tables['week_activity'].append(helper.week_activity_map(user, df, cube).reset_index())
+        tables['month_activity'].append(helper.monthly_activity_map(user, df, cube).reset_index())
+        heatmap = helper.activity_heatmap(user, df, cube)
+        tables['activity_heatmap'].append(heatmap.stack().rename('message').reset_index() if not heatmap.empty
+                                          else heatmap)
+        tables['most_common_words'].append(helper.most_common_words(user, df, word_counts))
+        tables['emojis'].append(helper.emoji_analyzer(user, df, emoji_counts))
+
+        for table in tables.values():
+            table[-1].insert(0, 'user', user)
+
+    tables = {name: pd.concat(frames, ignore_index=True) for name, frames in tables.items()}
+    tables['most_active_users'] = helper.most_active_users(df)[1]
+    tables['user_comparison'] = helper.compare_users(df, cube, emoji_counts)
+    return tables
+
+
+def write_tables(tables, output, name, fmt):
+    # JSON writes one file per chat; Parquet one file per table in a directory per chat
+    if fmt == 'json':
+        path = os.path.join(output, name + '.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({table: frame.to_dict('records') for table, frame in tables.items()}, f,
+                      ensure_ascii=False, indent=1, default=str)
+        return path
+
+    path = os.path.join(output, name)
+    os.makedirs(path, exist_ok=True)
+    for table, frame in tables.items():
+        frame.columns = [str(column) for column in frame.columns]
+        frame.to_parquet(os.path.join(path, table + '.parquet'), index=False)
+    return path
+
+
+def write_images(df, tables, users, output, name, word_counts=None):
+    # Plotting libraries are only imported when images are requested
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    for user in users:
+        prefix = os.path.join(output, f'{name}_{safe_name(user)}')
+
+        png = helper.wordcloud_png(user, df, word_counts)
+        if png is not None:
+            with open(prefix + '_wordcloud.png', 'wb') as f:
+                f.write(png)
+
+        timeline = tables['monthly_timeline'][tables['monthly_timeline']['user'] == user]
+        fig, ax = plt.subplots()
+        ax.plot(timeline['time'], timeline['message'])
+        plt.xticks(rotation='vertical')
+        plt.tight_layout()
+        fig.savefig(prefix + '_monthly_timeline.png')
+        plt.close(fig)
+
+
+def analyze_export(path, output, fmt='json', per_user=False, images=False, store_dir=None, name=None, workers=1):
+    """
+    Parses one export and writes its analyses; runs inside a worker process.
+
+    Parameters:
+    - path (str): Chat export to analyse.
+    - output (str): Directory results are written to.
+    - fmt (str): 'json' or 'parquet'.
+    - per_user (bool): Also analyse every member, not only 'Overall'.
+    - images (bool): Also write the word cloud and monthly timeline as PNG files.
+    - store_dir (str, optional): Also save the parsed chat to a columnar store under this directory.
+    - name (str, optional): Name of the outputs (default: the file name of the export).
+    - workers (int, optional): Processes a large export is parsed with; None uses every core.
+
+    Returns:
+    - dict: Summary with the source, output path, message count and elapsed seconds.
+    """
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        if workers != 1 and os.fstat(f.fileno()).st_size >= preprocessor.PARALLEL_MIN_SIZE:
+            df = preprocessor.preprocess_parallel(f.read(), workers, compact=True)
+        else:
+            df = preprocessor.preprocess_file(f, compact=True)
+
+    users = ['Overall']
+    if per_user:
+        users += sorted(df['user'].unique().tolist())
+
+    if name is None:
+        name = safe_name(os.path.splitext(os.path.basename(path))[0])
+    # Tokenized once for both the tables and the word clouds
+    word_counts = helper.count_words(df)
+    tables = analysis_tables(df, users, word_counts)
+    target = write_tables(tables, output, name, fmt)
+    if images:
+        write_images(df, tables, users, output, name, word_counts)
+    if store_dir:
+        import store
+        store.save_chat(df, os.path.join(store_dir, name))
+
+    return {'source': path, 'output': target, 'messages': len(df), 'seconds': round(time.perf_counter() - start, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse WhatsApp chat exports without the Streamlit app.')
+    parser.add_argument('inputs', nargs='+', help='Directories or glob patterns of .txt exports')
+    parser.add_argument('-o', '--output', default='reports', help='Directory to write results to')
+    parser.add_argument('-f', '--format', dest='fmt', choices=['json', 'parquet'], default='json')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--per-user', action='store_true', help='Also analyse every member of each chat')
+    parser.add_argument('--images', action='store_true', help='Also write word cloud and timeline images')
+    parser.add_argument('--store', help='Also save each parsed chat as a Parquet dataset under this directory')
+    args = parser.parse_args(argv)
+
+    paths = find_exports(args.inputs)
+    if not paths:
+        parser.error('no chat exports found')
+    names = export_names(paths)
+    # Names that still clash after cleaning would overwrite each other's results and store
+    seen = {}
+    for path, name in names.items():
+        if name in seen:
+            parser.error(f'{seen[name]} and {path} would both be written as {name!r}')
+        seen[name] = path
+    os.makedirs(args.output, exist_ok=True)
+
+    def report(path, result):
+        # Prints the summary of one export; returns 1 if it failed
+        try:
+            summary = result()
+            print(f"{summary['source']}: {summary['messages']} messages in {summary['seconds']}s "
+                  f"-> {summary['output']}")
+            return 0
+        except Exception:
+            print(f'{path}: failed', file=sys.stderr)
+            traceback.print_exc()
+            return 1
+
+    if len(paths) == 1:
+        # A single export has every core to itself, so a large one is parsed in parallel instead
+        path = paths[0]
+        failed = report(path, lambda: analyze_export(path, args.output, args.fmt, args.per_user, args.images,
+                                                     args.store, names[path], args.workers))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(analyze_export, path, args.output, args.fmt, args.per_user, args.images,
+                                       args.store, name): path
+                       for path, name in names.items()}
+            failed = sum(report(futures[future], future.result) for future in as_completed(futures))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
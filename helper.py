@@ -1,62 +1,438 @@
 from urlextract import URLExtract
-from wordcloud import WordCloud
 import pandas as pd
-from collections import Counter
+from functools import lru_cache
+import io
 import re
+import weakref
 import emoji
 
+import preprocessor
+import profiling
+
 # Initialize URL extractor
 extractor = URLExtract()
 
-def fetch_stats(selected_user, df):
+# Placeholders for any attachment left out of the export, capturing the kind of media
+MEDIA_PATTERN = r'^\u200e?(?:<(Media) omitted>|(image|video|audio|sticker|GIF|document) omitted)\s*$'
+
+# Cheap test for text that could contain a URL: a scheme, a dot followed by a TLD-like word
+# or an IPv4 address
+URL_HINT = r'://|\.[^\W\d_]{2,}|\d{1,3}(?:\.\d{1,3}){3}'
+
+
+@lru_cache(maxsize=65536)
+def count_urls(text):
+    # URLExtract is slow per call, so results for repeated texts are memoized
+    return len(extractor.find_urls(text))
+
+
+def count_links(messages):
+    """
+    Counts the URLs in each message.
+
+    Only messages passing the URL_HINT prefilter are handed to URLExtract, once per distinct text.
+
+    Parameters:
+    - messages (pd.Series): Message texts.
+
+    Returns:
+    - pd.Series: Number of URLs per message, aligned with messages.
+    """
+    with profiling.stage('count links', len(messages)):
+        link_count = pd.Series(0, index=messages.index, dtype='int64')
+        candidates = messages[messages.str.contains(URL_HINT, regex=True)]
+        if len(candidates):
+            counts = {text: count_urls(text) for text in candidates.unique()}
+            link_count[candidates.index] = candidates.map(counts).astype('int64')
+    return link_count
+
+
+def media_kinds(messages):
+    # Kind of media ('image', 'video', ... or 'Media' when unspecified) per message, NaN for text
+    with profiling.stage('media kinds', len(messages)):
+        kinds = messages.str.extract(MEDIA_PATTERN)
+    return kinds[0].fillna(kinds[1])
+
+
+def classify_messages(df, start=0):
+    """
+    Adds 'link_count' and 'media_kind' columns to the DataFrame, in place.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - start (int): Only rows from this position on are classified; earlier rows must already
+      carry both columns (e.g. after an incremental ingestion).
+
+    Returns:
+    - df (pd.DataFrame): The same DataFrame.
+    """
+    rows = df['message'].iloc[start:]
+    link_count = count_links(rows)
+    media_kind = media_kinds(rows)
+    if start:
+        link_count = pd.concat([df['link_count'].iloc[:start].astype('int64'), link_count])
+        media_kind = pd.concat([df['media_kind'].iloc[:start].astype(object), media_kind.astype(object)])
+
+    df['link_count'] = link_count.to_numpy()
+    df['media_kind'] = pd.Categorical(media_kind.to_numpy())
+    return df
+
+
+def build_cube(df):
+    """
+    Aggregates the chat into message, word, media and link counts per (user, date, hour).
+
+    The timeline, activity-map and heatmap helpers can be answered from the cube instead of
+    scanning every message again, so it only needs to be built once per dataset.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+
+    Returns:
+    - cube (pd.DataFrame): One row per (user, date, hour) with 'message', 'words', 'media' and 'links'
+      counts, plus 'stamp' (start of the hour), 'year', 'month_num', 'month' and 'day_name'; sorted
+      by 'stamp'.
+    """
+    # Columns from classify_messages are used when present
+    with profiling.stage('build cube', len(df)):
+        cube = df[['user', 'date', 'hour']].assign(
+            message=1,
+            words=df['message'].str.split().str.len(),
+            media=(df['media_kind'] if 'media_kind' in df else media_kinds(df['message'])).notna().astype('int64'),
+            links=df['link_count'] if 'link_count' in df else count_links(df['message']),
+        ).groupby(['user', 'date', 'hour'], observed=True, sort=False).sum().reset_index()
+
+    return add_calendar(cube)
+
+
+def add_calendar(cube):
+    # Derive the calendar columns the helpers group by from the cube's date, plus the start of
+    # each row's hour in 'stamp', by which the cube is sorted so ranges can be binary searched
+    cube['date'] = pd.to_datetime(cube['date'])
+    cube['stamp'] = cube['date'] + pd.to_timedelta(cube['hour'].astype('int64'), unit='h')
+    cube['year'] = cube['date'].dt.year
+    cube['month_num'] = cube['date'].dt.month
+    cube['month'] = cube['date'].dt.month_name()
+    cube['day_name'] = cube['date'].dt.day_name()
+    return cube.sort_values('stamp', kind='stable', ignore_index=True)
+
+
+def update_cube(cube, added, removed=None):
+    """
+    Updates an aggregate cube after rows were appended to (and optionally dropped from) the chat.
+
+    Parameters:
+    - cube (pd.DataFrame): Cube from build_cube for the old chat.
+    - added (pd.DataFrame): Rows that were added to the chat.
+    - removed (pd.DataFrame, optional): Rows of the old chat that were dropped.
+
+    Returns:
+    - cube (pd.DataFrame): Cube for the updated chat.
+    """
+    counts = ['message', 'words', 'media', 'links']
+    parts = [cube, build_cube(added)]
+    if removed is not None and len(removed):
+        removed = build_cube(removed)
+        removed[counts] *= -1
+        parts.append(removed)
+
+    cube = pd.concat(parts)[['user', 'date', 'hour'] + counts].groupby(
+        ['user', 'date', 'hour'], observed=True, sort=False).sum().reset_index()
+
+    return add_calendar(cube[cube['message'] > 0].reset_index(drop=True))
+
+
+# Sorted message dates of every DataFrame time_slice has been called on, keyed by id(df)
+_time_indexes = {}
+
+
+def time_index(df):
+    """
+    Returns the message dates of the chat in chronological order, for binary search.
+
+    preprocess keeps the order of the export, which is chronological, so this is normally a
+    zero-copy view with a RangeIndex. Otherwise the dates are sorted once and indexed by their
+    row positions. The index is built on first use and kept while the DataFrame is alive, so
+    frames must not be modified in place after they have been sliced.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+
+    Returns:
+    - pd.Series: Sorted message dates, indexed by row position.
+    """
+    key = id(df)
+    entry = _time_indexes.get(key)
+    if entry is None or entry[0]() is not df:
+        dates = pd.Series(df['message_date'].to_numpy())
+        if not dates.is_monotonic_increasing:
+            dates = dates.sort_values(kind='stable')
+        entry = _time_indexes[key] = (weakref.ref(df, lambda ref: _time_indexes.pop(key, None)), dates)
+    return entry[1]
+
+
+def time_slice(df, start=None, end=None):
+    """
+    Returns the messages sent at or after start and before end, found by binary search.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - start (date-like, optional): First moment of the range; unbounded when None.
+    - end (date-like, optional): End of the range, excluded; unbounded when None.
+
+    Returns:
+    - pd.DataFrame: The matching rows in their original order (df itself when there are no bounds).
+    """
+    if start is None and end is None:
+        return df
+
+    dates = time_index(df)
+    first = 0 if start is None else dates.searchsorted(pd.Timestamp(start))
+    last = len(dates) if end is None else dates.searchsorted(pd.Timestamp(end))
+    if isinstance(dates.index, pd.RangeIndex):
+        return df.iloc[first:last]
+    # Only exports that are out of order need the matching positions sorted back
+    return df.iloc[dates.index[first:last].sort_values()]
+
+
+def on_hour(bound):
+    # Whether a range bound falls on a whole hour, the resolution of the aggregate cube
+    return bound is None or pd.Timestamp(bound) == pd.Timestamp(bound).floor('h')
+
+
+def user_cube(selected_user, df, cube=None, start=None, end=None):
+    """
+    Returns the aggregate cube restricted to the selected user and time range.
+
+    Parameters:
+    - selected_user (str): The user to keep. 'Overall' includes all users.
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Cube from build_cube; built from df when not given.
+    - start (date-like, optional): Only keep messages sent at or after this time.
+    - end (date-like, optional): Only keep messages sent before this time.
+
+    Returns:
+    - pd.DataFrame: Cube rows for the selected user.
+    """
+    if start is not None or end is not None:
+        if cube is not None and on_hour(start) and on_hour(end):
+            # The cube is sorted by the start of each hour, so the range is found by binary search
+            first = 0 if start is None else cube['stamp'].searchsorted(pd.Timestamp(start))
+            last = len(cube) if end is None else cube['stamp'].searchsorted(pd.Timestamp(end))
+            cube = cube.iloc[first:last]
+        else:
+            # Bounds inside an hour need the messages themselves
+            df, cube = time_slice(df, start, end), None
+
+    if cube is None:
+        if selected_user != 'Overall':
+            df = df[df['user'] == selected_user]
+        return build_cube(df)
+
+    if selected_user != 'Overall':
+        cube = cube[cube['user'] == selected_user]
+    return cube
+
+# Define stop words to exclude from word analyses
+STOP_WORDS = frozenset(['ha', 'haa', 'haan', 'na', 'naa', 'nhi', 'keno', 'kyano', 'kano', 'bhai', 'vai', 'ei', 'e', 'ki',
+                        're', 'ami', 'tui', 'tumi', 'amay', 'amake', 'toke', 'amake', 'kor', 'korte', 'hobe', 'acha',
+                        'accha', 'achha', 'achchha', 'khub', 'aage', 'aaj', 'aj', 'kal', 'kaal', 'kya', 'kyu', 'kyun',
+                        'tu', 'tereko', 'ko', 'hi', 'se', 'to', 'toh', 'hoga', 'the', 'is', 'hai', 'of', 'you', 'hum',
+                        'main', 'and', 'bhi','theke','bol','ja','ta','er','o','kore','ar','aar','eta','ota','tai','kichu','ohh','uff','sob','shob','son','shon','kichhu','abar','ebar','but','te','amar','amr','sathe','shathe','bole','hobe','hbe','tho','tor','nei','ekta','thik','hoy','hoye','jani','oi','tr','r','or','kono','tao','ache','de','ke','ache','message','deleted','bhalo','this','that','niye','de','noy','was','ekhon','akhon','gulo','<omitted>','edited>','a','image','sticker','for','on','you','your','me','my','mine','him','her','his','in','to','all','with','are','we','will','from','have','it','at','as','our','not','be','is','so','no','please','have','has','had','been','so','no','yes','if','up','can','who','by','whose','whom','an','i','also','any','&','pm','am','hello','get','us','will','cannot','vlo','valo','bhalo','here','there','their','them','k','image','omitted','<sticker>','<edited>','j','je','keu','mone','kotha','kore','korbe','kor','dekh','dakh','vai','hm','hmm','ja','dekha','<this','diye','akta','ekta','jabe','din','jaabe','eto','gulo','naki','debo','na','naa','haan','haaaa','?','ami','tui','sticker omitted','hoe','hoye','jbe','of','\n'])
+
+
+def count_words(df):
+    """
+    Counts every non-stop word per user, the tokenization stage behind the word analyses.
+
+    Group notifications and '<Media omitted>' messages are left out.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+
+    Returns:
+    - word_counts (pd.Series): Counts indexed by (user, word).
+    """
+    with profiling.stage('count words', len(df)):
+        temp = df[(df['user'] != 'group_notification') & (df['message'] != '<Media omitted>\n')]
+
+        # One row per token, kept in order of first appearance
+        tokens = temp['message'].str.lower().str.split().explode().dropna()
+        tokens = tokens[~tokens.isin(STOP_WORDS)]
+        users = temp['user'].astype(object).reindex(tokens.index)
+
+        word_counts = tokens.groupby([users.to_numpy(), tokens.to_numpy()], sort=False).size()
+        word_counts.index.names = ['user', 'word']
+    return word_counts
+
+
+def update_word_counts(word_counts, added, removed=None):
+    """
+    Updates word counts after rows were appended to (and optionally dropped from) the chat.
+
+    Parameters:
+    - word_counts (pd.Series): Counts from count_words for the old chat.
+    - added (pd.DataFrame): Rows that were added to the chat.
+    - removed (pd.DataFrame, optional): Rows of the old chat that were dropped.
+
+    Returns:
+    - word_counts (pd.Series): Counts for the updated chat.
+    """
+    return merge_counts(word_counts, count_words(added),
+                        count_words(removed) if removed is not None and len(removed) else None)
+
+
+def merge_counts(counts, added, removed=None):
+    # Adds (and subtracts) per-user count tables indexed by (user, item), dropping zero counts
+    parts = [counts, added] if removed is None else [counts, added, -removed]
+    counts = pd.concat(parts).groupby(level=[0, 1], sort=False).sum()
+    return counts[counts > 0]
+
+
+def user_word_counts(selected_user, df, word_counts=None, start=None, end=None):
+    """
+    Returns the word counts of the selected user, indexed by word.
+
+    Parameters:
+    - selected_user (str): The user whose words are counted. 'Overall' includes all users.
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - word_counts (pd.Series, optional): Counts from count_words; computed from df when not given.
+    - start (date-like, optional): Only count messages sent at or after this time.
+    - end (date-like, optional): Only count messages sent before this time.
+
+    Returns:
+    - pd.Series: Word frequencies indexed by word.
+    """
+    if start is not None or end is not None:
+        # Precomputed counts cover the whole chat, so a range is counted from its messages
+        df, word_counts = time_slice(df, start, end), None
+
+    if word_counts is None:
+        if selected_user != 'Overall':
+            df = df[df['user'] == selected_user]
+        word_counts = count_words(df)
+
+    if selected_user != 'Overall':
+        word_counts = word_counts[word_counts.index.get_level_values('user') == selected_user]
+    return word_counts.groupby(level='word', sort=False).sum()
+
+
+
+def trie_pattern(words):
+    # Regex matching any of the words, built from their prefix trie so the engine never has to try
+    # thousands of alternatives at a position; longer words win over their prefixes
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = []
+        leaves = []
+        for char, child in sorted(node.items()):
+            if char == '':
+                continue
+            if list(child) == ['']:
+                leaves.append(re.escape(char))
+            else:
+                branches.append(re.escape(char) + build(child))
+        if leaves:
+            branches.append(leaves[0] if len(leaves) == 1 else '[' + ''.join(leaves) + ']')
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + pattern + ')?' if '' in node else pattern
+
+    return build(trie)
+
+
+# Every emoji sequence known to the emoji package, including ZWJ, flag, keycap and skin-tone
+# sequences. The lookahead skips plain ASCII positions before entering the trie.
+EMOJI_PATTERN = re.compile(r'(?=[^\x00-\x22\x24-\x29\x2b-\x2f\x3a-\x7f])' + trie_pattern(emoji.EMOJI_DATA))
+
+
+def count_emojis(df):
+    """
+    Counts every emoji per user, the extraction stage behind emoji_analyzer.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+
+    Returns:
+    - emoji_counts (pd.Series): Counts indexed by (user, emoji).
+    """
+    # Messages without any non-ASCII character cannot contain an emoji
+    with profiling.stage('count emojis', len(df)):
+        candidates = df[df['message'].str.contains(r'[^\x00-\x7f]', regex=True)]
+        emojis = candidates['message'].str.findall(EMOJI_PATTERN).explode().dropna()
+        users = candidates['user'].astype(object).reindex(emojis.index)
+
+        emoji_counts = emojis.groupby([users.to_numpy(), emojis.to_numpy()], sort=False).size()
+        emoji_counts.index.names = ['user', 'emoji']
+    return emoji_counts
+
+
+def update_emoji_counts(emoji_counts, added, removed=None):
+    """
+    Updates emoji counts after rows were appended to (and optionally dropped from) the chat.
+
+    Parameters:
+    - emoji_counts (pd.Series): Counts from count_emojis for the old chat.
+    - added (pd.DataFrame): Rows that were added to the chat.
+    - removed (pd.DataFrame, optional): Rows of the old chat that were dropped.
+
+    Returns:
+    - emoji_counts (pd.Series): Counts for the updated chat.
+    """
+    return merge_counts(emoji_counts, count_emojis(added),
+                        count_emojis(removed) if removed is not None and len(removed) else None)
+
+def fetch_stats(selected_user, df, cube=None, start=None, end=None):
     """
     Fetches statistics related to messages, words, media, and links from the DataFrame for the selected user.
 
     Parameters:
     - selected_user (str): The user for whom statistics are fetched. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Precomputed aggregate cube from build_cube.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - num_messages (int): Total number of messages for the selected user.
     - words (int): Total number of words in messages for the selected user.
     - num_media_messages (int): Total number of media messages (images, etc.) for the selected user.
-    - len(links) (int): Total number of unique links shared in messages for the selected user.
+    - num_links (int): Total number of links shared in messages for the selected user.
     """
     try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
-
-        num_messages = df.shape[0]
-        words = sum(len(message.split()) for message in df['message'])
+        counts = user_cube(selected_user, df, cube, start, end)[['message', 'words', 'media', 'links']].sum()
+        num_messages = int(counts['message'])
+        words = int(counts['words'])
+        num_media_messages = int(counts['media'])
+        num_links = int(counts['links'])
 
-        # num_media_messages = df[df['message'] == '<Media omitted>\n'].shape[0]
-        # if num_media_messages == 0:
-        num_media_messages = df[df['message'] == '\u200eimage omitted\n'].shape[0]
-
-        links = []
-        for message in df['message']:
-            links.extend(extractor.find_urls(message))
-        
-
-        return num_messages, words, num_media_messages, len(set(links))
+        return num_messages, words, num_media_messages, num_links
 
     except Exception as e:
         print(f"Error in fetch_stats: {e}")
         return 0, 0, 0, 0
 
 
-def most_active_users(df):
+def most_active_users(df, start=None, end=None):
     """
     Computes the most active users based on message count and their percentage contribution.
 
     Parameters:
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - x (pd.Series): Series with counts of messages per user.
     - df (pd.DataFrame): DataFrame with percentage contribution of messages per user.
     """
     try:
+        df = time_slice(df, start, end)
         x = df['user'].value_counts().head()
         df = round((df['user'].value_counts() / df.shape[0]) * 100, 2).reset_index().rename(
             columns={'index': 'name', 'user': 'percent'})
@@ -67,27 +443,93 @@ def most_active_users(df):
         return pd.Series(), pd.DataFrame()
 
 
-def create_wordcloud(selected_user, df):
+def compare_users(df, cube=None, emoji_counts=None, start=None, end=None):
+    """
+    Compares every member of the chat in one grouped pass instead of one analysis per user.
+
+    Group notifications are left out.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Precomputed aggregate cube from build_cube.
+    - emoji_counts (pd.Series, optional): Precomputed emoji counts from count_emojis.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
+
+    Returns:
+    - comparison (pd.DataFrame): One row per user with 'messages', 'words', 'media', 'links', 'emojis',
+      'percent' (share of all messages), 'latency' (median minutes taken to reply to someone else),
+      the percentage of the user's messages sent in each hour ('hour_00' to 'hour_23') and on each
+      weekday ('Monday' to 'Sunday').
+    """
+    try:
+        with profiling.stage('compare users', len(df)):
+            cube = user_cube('Overall', df, cube, start, end)
+            df = time_slice(df, start, end)
+            if emoji_counts is None or start is not None or end is not None:
+                emoji_counts = count_emojis(df)
+
+            cube = cube[cube['user'] != 'group_notification']
+            comparison = cube.groupby('user', observed=True)[['message', 'words', 'media', 'links']].sum().rename(
+                columns={'message': 'messages'})
+            comparison.index = comparison.index.astype(object)
+            comparison['emojis'] = emoji_counts.groupby(level='user').sum().reindex(comparison.index, fill_value=0)
+            comparison['percent'] = round(comparison['messages'] / comparison['messages'].sum() * 100, 2)
+
+            # A reply is a message following one from someone else; its latency is the gap between the two
+            messages = df[df['user'] != 'group_notification']
+            codes = pd.Series(pd.factorize(messages['user'])[0], index=messages.index)
+            replies = codes.ne(codes.shift()) & codes.shift().notna()
+            gaps = messages['message_date'].diff()[replies].dt.total_seconds() / 60
+            latency = gaps.groupby(messages['user'][replies].astype(object)).median()
+            comparison['latency'] = round(latency.reindex(comparison.index), 2)
+
+            # Distribution of each user's messages over the hours of the day and the days of the week
+            hourly = cube.groupby(['user', 'hour'], observed=True)['message'].sum().unstack(fill_value=0)
+            hourly = hourly.reindex(index=comparison.index, columns=range(24), fill_value=0)
+            hourly.columns = [f'hour_{hour:02d}' for hour in hourly.columns]
+            weekly = cube.groupby(['user', 'day_name'], observed=True)['message'].sum().unstack(fill_value=0)
+            weekly = weekly.reindex(index=comparison.index, columns=preprocessor.DAYS, fill_value=0)
+            for distribution in (hourly, weekly):
+                comparison = comparison.join(round(distribution.div(comparison['messages'], axis=0) * 100, 2))
+
+        comparison.index.name = 'user'
+        return comparison.reset_index()
+
+    except Exception as e:
+        print(f"Error in compare_users: {e}")
+        return pd.DataFrame()
+
+
+def create_wordcloud(selected_user, df, word_counts=None, width=500, height=500, start=None, end=None):
     """
     Creates a WordCloud based on messages for the selected user.
 
+    The cloud is laid out from the same word frequencies as most_common_words, so messages are
+    not concatenated and re-tokenized.
+
     Parameters:
     - selected_user (str): The user for whom the WordCloud is generated. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - word_counts (pd.Series, optional): Precomputed word counts from count_words.
+    - width (int): Width of the image in pixels.
+    - height (int): Height of the image in pixels.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - wc (WordCloud): WordCloud object generated based on the messages.
     """
     try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
+        frequencies = user_word_counts(selected_user, df, word_counts, start, end)
 
-        # Filter out non-relevant messages
-        temp = df[(df['user'] != 'group_notification') & (df['message'] != '<Media omitted>\n')]
+        # Imported here so analyses that never draw a cloud don't load matplotlib
+        from wordcloud import WordCloud
 
         # Generate WordCloud
-        wc = WordCloud(width=500, height=500, min_font_size=10, background_color='white')
-        df_wc = wc.generate(temp['message'].str.cat(sep=' '))
+        wc = WordCloud(width=width, height=height, min_font_size=10, background_color='white')
+        with profiling.stage('wordcloud layout', len(frequencies)):
+            df_wc = wc.generate_from_frequencies(frequencies.to_dict())
 
         return df_wc
 
@@ -96,42 +538,51 @@ def create_wordcloud(selected_user, df):
         return None
 
 
-def most_common_words(selected_user, df):
+def wordcloud_png(selected_user, df, word_counts=None, width=500, height=500, start=None, end=None):
     """
-    Finds the most common words used by the selected user in their messages.
+    Renders the WordCloud of the selected user to PNG bytes, which are cheap to cache and display.
 
     Parameters:
-    - selected_user (str): The user for whom common words are identified. 'Overall' includes all users.
+    - selected_user (str): The user for whom the WordCloud is generated. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - word_counts (pd.Series, optional): Precomputed word counts from count_words.
+    - width (int): Width of the image in pixels.
+    - height (int): Height of the image in pixels.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
-    - most_common_df (pd.DataFrame): DataFrame with the most common words and their frequencies.
+    - bytes: PNG image, or None when there are no words to show.
     """
-    try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
+    wc = create_wordcloud(selected_user, df, word_counts, width, height, start, end)
+    if wc is None:
+        return None
 
-        # Filter out non-relevant messages
-        temp = df[(df['user'] != 'group_notification') & (df['message'] != '<Media omitted>\n')]
+    buffer = io.BytesIO()
+    wc.to_image().save(buffer, format='PNG')
+    return buffer.getvalue()
 
-        # Define stop words to exclude from analysis
-        stop_words = ['ha', 'haa', 'haan', 'na', 'naa', 'nhi', 'keno', 'kyano', 'kano', 'bhai', 'vai', 'ei', 'e', 'ki',
-                      're', 'ami', 'tui', 'tumi', 'amay', 'amake', 'toke', 'amake', 'kor', 'korte', 'hobe', 'acha',
-                      'accha', 'achha', 'achchha', 'khub', 'aage', 'aaj', 'aj', 'kal', 'kaal', 'kya', 'kyu', 'kyun',
-                      'tu', 'tereko', 'ko', 'hi', 'se', 'to', 'toh', 'hoga', 'the', 'is', 'hai', 'of', 'you', 'hum',
-                      'main', 'and', 'bhi','theke','bol','ja','ta','er','o','kore','ar','aar','eta','ota','tai','kichu','ohh','uff','sob','shob','son','shon','kichhu','abar','ebar','but','te','amar','amr','sathe','shathe','bole','hobe','hbe','tho','tor','nei','ekta','thik','hoy','hoye','jani','oi','tr','r','or','kono','tao','ache','de','ke','ache','message','deleted','bhalo','this','that','niye','de','noy','was','ekhon','akhon','gulo','<omitted>','edited>','a','image','sticker','for','on','you','your','me','my','mine','him','her','his','in','to','all','with','are','we','will','from','have','it','at','as','our','not','be','is','so','no','please','have','has','had','been','so','no','yes','if','up','can','who','by','whose','whom','an','i','also','any','&','pm','am','hello','get','us','will','cannot','vlo','valo','bhalo','here','there','their','them','k','image','omitted','<sticker>','<edited>','j','je','keu','mone','kotha','kore','korbe','kor','dekh','dakh','vai','hm','hmm','ja','dekha','<this','diye','akta','ekta','jabe','din','jaabe','eto','gulo','naki','debo','na','naa','haan','haaaa','?','ami','tui','sticker omitted','hoe','hoye','jbe','of','\n']
 
-        # Initialize list to store words
-        words = []
+def most_common_words(selected_user, df, word_counts=None, start=None, end=None):
+    """
+    Finds the most common words used by the selected user in their messages.
 
-        # Iterate through messages to extract words
-        for message in temp['message']:
-            for word in message.lower().split():
-                if word not in stop_words:
-                    words.append(word)
+    Parameters:
+    - selected_user (str): The user for whom common words are identified. 'Overall' includes all users.
+    - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - word_counts (pd.Series, optional): Precomputed word counts from count_words.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
+
+    Returns:
+    - most_common_df (pd.DataFrame): DataFrame with the most common words and their frequencies.
+    """
+    try:
+        counts = user_word_counts(selected_user, df, word_counts, start, end)
 
         # Create DataFrame of most common words
-        most_common_df = pd.DataFrame(Counter(words).most_common(20), columns=['Word', 'Frequency'])
+        most_common_df = counts.sort_values(ascending=False, kind='stable').head(20).reset_index()
+        most_common_df.columns = ['Word', 'Frequency']
 
         return most_common_df
 
@@ -140,26 +591,28 @@ def most_common_words(selected_user, df):
         return pd.DataFrame()
 
 
-def monthly_timeline(selected_user, df):
+def monthly_timeline(selected_user, df, cube=None, start=None, end=None):
     """
     Generates a monthly timeline of messages for the selected user.
 
     Parameters:
     - selected_user (str): The user for whom the timeline is generated. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Precomputed aggregate cube from build_cube.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - timeline (pd.DataFrame): DataFrame with monthly timeline of messages.
     """
     try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
+        cube = user_cube(selected_user, df, cube, start, end)
 
         # Group messages by year and month to count messages
-        timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
+        timeline = cube.groupby(['year', 'month_num', 'month'])['message'].sum().reset_index()
 
         # Create time column combining month and year
-        timeline['time'] = timeline['month'] + '-' + timeline['year'].astype(str)
+        timeline['time'] = timeline['month'].astype(str) + '-' + timeline['year'].astype(str)
 
         return timeline
 
@@ -168,23 +621,29 @@ def monthly_timeline(selected_user, df):
         return pd.DataFrame()
 
 
-def daily_timeline(selected_user, df):
+def daily_timeline(selected_user, df, cube=None, max_points=None, start=None, end=None):
     """
     Generates a daily timeline of messages for the selected user.
 
     Parameters:
     - selected_user (str): The user for whom the timeline is generated. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Precomputed aggregate cube from build_cube.
+    - max_points (int, optional): Downsample the timeline to at most this many points (see downsample_timeline).
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - daily_timeline (pd.DataFrame): DataFrame with daily timeline of messages.
     """
     try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
+        cube = user_cube(selected_user, df, cube, start, end)
 
         # Group messages by date to count messages
-        daily_timeline = df.groupby('date').count()['message'].reset_index()
+        daily_timeline = cube.groupby('date')['message'].sum().reset_index()
+
+        if max_points is not None:
+            daily_timeline = downsample_timeline(daily_timeline, max_points)
 
         return daily_timeline
 
@@ -193,69 +652,95 @@ def daily_timeline(selected_user, df):
         return pd.DataFrame()
 
 
-def week_activity_map(selected_user, df):
+def downsample_timeline(timeline, max_points):
+    """
+    Sums a daily timeline into weeks, months, quarters or years, whichever is the finest
+    resolution that fits in max_points.
+
+    Parameters:
+    - timeline (pd.DataFrame): Timeline with 'date' and 'message' columns, one row per day.
+    - max_points (int): Maximum number of rows to return.
+
+    Returns:
+    - pd.DataFrame: Timeline with the same columns, labelled by the start of each period.
+    """
+    series = timeline.set_index('date')['message']
+    for rule in ('W-MON', 'MS', 'QS', 'YS'):
+        if len(timeline) <= max_points:
+            break
+        timeline = series.resample(rule, label='left', closed='left').sum().reset_index()
+    return timeline
+
+
+def week_activity_map(selected_user, df, cube=None, start=None, end=None):
     """
     Generates a weekly activity map (message count per day) for the selected user.
 
     Parameters:
     - selected_user (str): The user for whom the activity map is generated. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Precomputed aggregate cube from build_cube.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - pd.Series: Series with counts of messages per day.
     """
     try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
+        cube = user_cube(selected_user, df, cube, start, end)
 
         # Count messages per day of the week
-        return df['day_name'].value_counts()
+        return cube.groupby('day_name')['message'].sum().sort_values(ascending=False).rename('count')
 
     except Exception as e:
         print(f"Error in week_activity_map: {e}")
         return pd.Series()
 
 
-def monthly_activity_map(selected_user, df):
+def monthly_activity_map(selected_user, df, cube=None, start=None, end=None):
     """
     Generates a monthly activity map (message count per month) for the selected user.
 
     Parameters:
     - selected_user (str): The user for whom the activity map is generated. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Precomputed aggregate cube from build_cube.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - pd.Series: Series with counts of messages per month.
     """
     try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
+        cube = user_cube(selected_user, df, cube, start, end)
 
         # Count messages per month
-        return df['month'].value_counts()
+        return cube.groupby('month')['message'].sum().sort_values(ascending=False).rename('count')
 
     except Exception as e:
         print(f"Error in monthly_activity_map: {e}")
         return pd.Series()
 
 
-def activity_heatmap(selected_user, df):
+def activity_heatmap(selected_user, df, cube=None, start=None, end=None):
     """
     Generates an activity heatmap (message count per hour per day) for the selected user.
 
     Parameters:
     - selected_user (str): The user for whom the heatmap is generated. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - cube (pd.DataFrame, optional): Precomputed aggregate cube from build_cube.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - pd.DataFrame: DataFrame with message counts organized by hour and day.
     """
     try:
-        if selected_user != 'Overall':
-            df = df[df['user'] == selected_user]
+        cube = user_cube(selected_user, df, cube, start, end)
 
         # Create a pivot table for message counts per hour per day
-        user_heatmap = df.pivot_table(index='day_name', columns='hour', values='message', aggfunc='count').fillna(0)
+        user_heatmap = cube.pivot_table(index='day_name', columns='hour', values='message', aggfunc='sum').fillna(0)
 
         return user_heatmap
 
@@ -264,28 +749,36 @@ def activity_heatmap(selected_user, df):
         return pd.DataFrame()
 
 
-def emoji_analyzer(given_user, df):
+def emoji_analyzer(given_user, df, emoji_counts=None, start=None, end=None):
     """
     Analyzes the usage of emojis by the selected user.
 
     Parameters:
     - given_user (str): The user for whom emoji usage is analyzed. 'Overall' includes all users.
     - df (pd.DataFrame): The DataFrame containing WhatsApp chat data.
+    - emoji_counts (pd.Series, optional): Precomputed emoji counts from count_emojis.
+    - start (date-like, optional): Only include messages sent at or after this time.
+    - end (date-like, optional): Only include messages sent before this time.
 
     Returns:
     - emojis_df (pd.DataFrame): DataFrame with emojis and their counts.
     """
     try:
-        if given_user != 'Overall':
-            df = df[df['user'] == given_user]
+        if start is not None or end is not None:
+            # Precomputed counts cover the whole chat, so a range is counted from its messages
+            df, emoji_counts = time_slice(df, start, end), None
 
-        emojis = []
-        emoji_pattern = re.compile(r'\p{Emoji}')
+        if emoji_counts is None:
+            if given_user != 'Overall':
+                df = df[df['user'] == given_user]
+            emoji_counts = count_emojis(df)
 
-        for message in df['message']:
-            emojis.extend(emoji_pattern.findall(message))
+        if given_user != 'Overall':
+            emoji_counts = emoji_counts[emoji_counts.index.get_level_values('user') == given_user]
 
-        emojis_df = pd.DataFrame(Counter(emojis).most_common(), columns=['Emoji', 'Count'])
+        counts = emoji_counts.groupby(level='emoji', sort=False).sum()
+        emojis_df = counts.sort_values(ascending=False, kind='stable').reset_index()
+        emojis_df.columns = ['Emoji', 'Count']
 
         return emojis_df
 
@@ -1,73 +1,437 @@
+import codecs
+import hashlib
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
-def preprocess(data):
-    # messages = re.split(r'\d{2}/\d{2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s', data)[1:]
-    # dates = re.findall(r'\d{2}/\d{2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s', data)
+import profiling
+
+# Supported export formats, in the order they are tried.
+# Each entry is (header prefix, timestamp, header suffix, strptime format for the timestamp).
+FORMATS = {
+    # 24-hour Android export: "dd/mm/yy, hh:mm - "
+    '24h': ('', r'\d{2}/\d{2}/\d{2,4},\s\d{1,2}:\d{2}', r'\s-\s', '%d/%m/%y, %H:%M'),
+    # 12-hour Android export: "dd/mm/yyyy, hh:mm AM - "
+    '12h': ('', r'\d{2}/\d{2}/\d{4},\s\d{1,2}:\d{2}\s[AaPp][Mm]', r'\s-\s', '%d/%m/%Y, %I:%M %p'),
+    # iOS export: "[dd/mm/yy, hh:mm:ss AM] "
+    'ios': (r'\[', r'\d{2}/\d{2}/\d{2},\s\d{1,2}:\d{2}:\d{2}\s[AaPp][Mm]', r'\]\s', '%d/%m/%y, %I:%M:%S %p'),
+}
+
+# Only the head of the export is inspected to pick a format
+SNIFF_SIZE = 8192
+
+# Amount read from a file handle at a time when streaming
+CHUNK_SIZE = 1 << 20
+
+# Exports smaller than this are parsed serially by preprocess_parallel
+PARALLEL_MIN_SIZE = 8 << 20
+
+# Calendar names in calendar order
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Hour-of-day buckets, indexed by hour
+PERIODS = ['00-1'] + [str(hour) + '-' + str(hour + 1) for hour in range(1, 23)] + ['23-00']
+
+# Columns of the frames built by preprocess, in order
+COLUMNS = ['message_date', 'user', 'message', 'year', 'month', 'day', 'day_name', 'hour', 'minute', 'month_num',
+           'date', 'period']
+
+_header_cache = {}
+_message_cache = {}
+_boundary_cache = {}
 
-    messages=re.split('\d{2}/\d{2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s',data)[1:]
-    dates=re.findall('\d{2}/\d{2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s',data)
 
-    df=pd.DataFrame({'user_message':messages,'message_date':dates})
-    df['message_date']=pd.to_datetime(df['message_date'],format='%d/%m/%y, %H:%M - ')
+def header_pattern(fmt, binary=False):
+    # Pattern matching a single message header (timestamp included), on str or on raw UTF-8 bytes
+    key = (fmt, binary)
+    if key not in _header_cache:
+        prefix, stamp, suffix, _ = FORMATS[fmt]
+        pattern = prefix + stamp + suffix
+        _header_cache[key] = re.compile(pattern.encode('ascii') if binary else pattern)
+    return _header_cache[key]
 
-    if messages==[] or dates==[]:
 
-        messages=re.split('\d{2}/\d{2}/\d{4},\s\d{1,2}:\d{2}\s[AaPp][Mm]\s-\s',data)[1:]
-        # dates = re.findall(r'\d{2}/\d{2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s', data)
-        dates=re.findall('\d{2}/\d{2}/\d{4},\s\d{1,2}:\d{2}\s[AaPp][Mm]\s-\s',data)
+def message_pattern(fmt):
+    # Combined pattern matching a whole message: timestamp, optional author and the body
+    # up to the next header (or the end of the text)
+    if fmt not in _message_cache:
+        prefix, stamp, suffix, _ = FORMATS[fmt]
+        header = prefix + stamp + suffix
+        _message_cache[fmt] = re.compile(
+            prefix + '(?P<stamp>' + stamp + ')' + suffix +
+            r'(?:(?P<user>[^\n]+?):\s)?' +
+            r'(?P<message>[\s\S]*?)(?=' + header + r'|\Z)'
+        )
+    return _message_cache[fmt]
 
-        # messages=re.split('\d{2}/\d{2}/\d{4},\s\d{1,2}:\d{2}\s[AaPp][Mm]\s-\s',data)[1:]
-        # dates=re.findall('\d{2}/\d{2}/\d{4},\s\d{1,2}:\d{2}\s[AaPp][Mm]\s-\s',data)
 
-        df=pd.DataFrame({'user_message':messages,'message_date':dates})
-        df['message_date']=pd.to_datetime(df['message_date'], format='%d/%m/%Y, %H:%M %p - ')
+def boundary_pattern(fmt, binary=False):
+    # Pattern matching a newline followed by a message header, on str or on raw UTF-8 bytes
+    key = (fmt, binary)
+    if key not in _boundary_cache:
+        pattern = r'\n' + header_pattern(fmt).pattern
+        _boundary_cache[key] = re.compile(pattern.encode('ascii') if binary else pattern)
+    return _boundary_cache[key]
 
-        if messages==[] or dates==[]:
 
-            messages=re.split(r'\[\d{2}/\d{2}/\d{2},\s\d{1,2}:\d{2}:\d{2}\s[AaPp][Mm]\]\s',data)[1:]
-            # dates = re.findall(r'\d{2}/\d{2}/\d{2,4},\s\d{1,2}:\d{2}\s-\s', data)
-            dates=re.findall(r'\d{2}/\d{2}/\d{2},\s\d{1,2}:\d{2}:\d{2}\s[AaPp][Mm]',data)
-        # df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-        # df['message_date'] = pd.to_datetime(df['message_date'], format='%d/%m/%Y, %H:%M - ')
+def detect_format(data):
+    # Sniff the format from the head of the export, falling back to the full text
+    for sample in (data[:SNIFF_SIZE], data):
+        for fmt in FORMATS:
+            if header_pattern(fmt).search(sample):
+                return fmt
+        if len(sample) == len(data):
+            break
+    return None
 
-            df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-            # df2['message_date'] = pd.to_datetime(df2['message_date'], format='%d/%m/%Y, %H:%M - ')
-            df['message_date']=pd.to_datetime(df['message_date'])
 
+def parse_messages(data, fmt):
+    # Extract every message in a single pass over the text
+    stamps = []
     users = []
     messages = []
-    for message in df['user_message']:
-        entry = re.split('([\w\W]+?):\s', message)
-        if entry[1:]:
-            users.append(entry[1])
-            messages.append(entry[2])
-        else:
-            users.append('group_notification')
-            messages.append(entry[0])
-    df['user'] = users
-    df['message'] = messages
-    df.drop(columns=['user_message'], inplace=True)
-
-
-    df['year']=df['message_date'].dt.year
-    df['month']=df['message_date'].dt.month_name()
-    df['day']=df['message_date'].dt.day
-    df['day_name'] = df['message_date'].dt.day_name()
-    df['hour']=df['message_date'].dt.hour
-    df['minute']=df['message_date'].dt.minute
-    df['month_num'] = df['message_date'].dt.month
-    df['date'] = df['message_date'].dt.date
-
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + '-' + str('00'))
-        elif hour == 0:
-            period.append(str('00') + '-' + str(hour + 1))
+    with profiling.stage('parse messages') as record:
+        for match in message_pattern(fmt).finditer(data):
+            stamp, user, message = match.group('stamp', 'user', 'message')
+            stamps.append(stamp)
+            users.append(user if user is not None else 'group_notification')
+            messages.append(message)
+        record['rows'] = len(stamps)
+    return stamps, users, messages
+
+
+def build_frame(stamps, users, messages, fmt):
+    df = pd.DataFrame({'message_date': stamps, 'user': users, 'message': messages}, dtype=str)
+    with profiling.stage('to_datetime', len(df)):
+        df['message_date'] = pd.to_datetime(df['message_date'], format=FORMATS[fmt][3] if fmt else None)
+
+    with profiling.stage('calendar columns', len(df)):
+        df['year']=df['message_date'].dt.year
+        df['month']=df['message_date'].dt.month_name()
+        df['day']=df['message_date'].dt.day
+        df['day_name'] = df['message_date'].dt.day_name()
+        df['hour']=df['message_date'].dt.hour
+        df['minute']=df['message_date'].dt.minute
+        df['month_num'] = df['message_date'].dt.month
+        df['date'] = df['message_date'].dt.date
+
+        df['period'] = pd.Categorical.from_codes(df['hour'], categories=PERIODS, ordered=True)
+
+    return df
+
+
+def preprocess(data, compact=False):
+    fmt = detect_format(data)
+    if fmt is None:
+        df = build_frame([], [], [], None)
+    else:
+        df = build_frame(*parse_messages(data, fmt), fmt)
+
+    return compact_schema(df) if compact else df
+
+
+def last_boundary(text, fmt):
+    # Offset of the last line in the text (str or bytes) that starts with a message header, or None
+    binary = isinstance(text, bytes)
+    header = header_pattern(fmt, binary)
+    newline = b'\n' if binary else '\n'
+    end = len(text)
+    while True:
+        start = text.rfind(newline, 0, end) + 1
+        if header.match(text, start):
+            return start
+        if start == 0:
+            return None
+        end = start - 1
+
+
+def preprocess_stream(fileobj, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    """
+    Parses a chat export from a file handle, yielding DataFrame batches as the file is read.
+
+    Only complete messages are emitted; a message that may still continue in the next
+    chunk is carried over, so peak memory stays around one chunk plus the output.
+
+    Parameters:
+    - fileobj: Binary or text file handle to read the export from.
+    - chunk_size (int): Number of bytes (or characters) read at a time.
+    - encoding (str): Encoding used to decode binary handles.
+
+    Returns:
+    - Generator of pd.DataFrame batches with the same columns as preprocess.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ''
+    fmt = None
+    eof = False
+
+    while not eof:
+        chunk = fileobj.read(chunk_size)
+        eof = not chunk
+        with profiling.stage('decode'):
+            buffer += decoder.decode(chunk, final=eof) if isinstance(chunk, bytes) else chunk
+
+        if fmt is None:
+            if len(buffer) < SNIFF_SIZE and not eof:
+                continue
+            fmt = detect_format(buffer)
+            if fmt is None:
+                # Nothing that looks like a message yet, only keep enough to catch a split header
+                buffer = buffer[-SNIFF_SIZE:]
+                continue
+
+        if eof:
+            text, buffer = buffer, ''
         else:
-            period.append(str(hour) + '-' + str(hour + 1))
+            cut = last_boundary(buffer, fmt)
+            if not cut:
+                continue
+            text, buffer = buffer[:cut], buffer[cut:]
+
+        stamps, users, messages = parse_messages(text, fmt)
+        if stamps:
+            yield build_frame(stamps, users, messages, fmt)
+
+
+def preprocess_file(fileobj, chunk_size=CHUNK_SIZE, encoding='utf-8', compact=False):
+    # Streams the export and joins the batches into a single DataFrame
+    batches = list(preprocess_stream(fileobj, chunk_size, encoding))
+    if not batches:
+        df = build_frame([], [], [], None)
+    else:
+        df = pd.concat(batches, ignore_index=True)
+
+    return compact_schema(df) if compact else df
+
+
+def compact_schema(df, arrow_strings=False):
+    """
+    Converts a preprocessed DataFrame to a compact column layout.
 
-    df['period']=period
+    Names become categoricals, calendar fields small integers and 'date' a datetime64 column
+    (normalized to midnight) instead of Python date objects.
 
+    Parameters:
+    - df (pd.DataFrame): DataFrame returned by preprocess.
+    - arrow_strings (bool): Store 'message' as Arrow-backed strings (requires pyarrow).
+
+    Returns:
+    - pd.DataFrame: A new DataFrame with the same columns and values in compact dtypes.
+    """
+    df = df.copy()
+    df['user'] = df['user'].astype('category')
+    df['month'] = pd.Categorical(df['month'], categories=MONTHS, ordered=True)
+    df['day_name'] = pd.Categorical(df['day_name'], categories=DAYS, ordered=True)
+    df['year'] = df['year'].astype('int16')
+    for column in ('day', 'hour', 'minute', 'month_num'):
+        df[column] = df[column].astype('int8')
+    # pandas has no day resolution, so dates are kept as datetimes at midnight
+    df['date'] = df['message_date'].dt.normalize()
+    if arrow_strings:
+        df['message'] = df['message'].astype('string[pyarrow]')
     return df
+
+
+def memory_report(df, arrow_strings=False):
+    """
+    Compares the memory used by each column in the default and the compact layout.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame returned by preprocess (default layout).
+    - arrow_strings (bool): Whether the compact layout stores 'message' as Arrow strings.
+
+    Returns:
+    - pd.DataFrame: Bytes per column for both layouts and their ratio, with a 'Total' row.
+    """
+    report = pd.DataFrame({
+        'default': df.memory_usage(deep=True, index=False),
+        'compact': compact_schema(df, arrow_strings).memory_usage(deep=True, index=False),
+    })
+    report.loc['Total'] = report.sum()
+    report['ratio'] = (report['default'] / report['compact']).round(2)
+    return report
+
+
+def split_ranges(data, fmt, parts):
+    """
+    Cuts an export into about `parts` consecutive ranges that each start at a message header.
+
+    Parameters:
+    - data (str or bytes): The full export.
+    - fmt (str): Export format, as returned by detect_format.
+    - parts (int): Number of ranges to aim for.
+
+    Returns:
+    - list of (start, end) offsets covering the whole of data.
+    """
+    boundary = boundary_pattern(fmt, isinstance(data, bytes))
+    bounds = [0]
+    for part in range(1, parts):
+        target = max(len(data) * part // parts, bounds[-1])
+        match = boundary.search(data, target)
+        if match is None:
+            break
+        if match.start() + 1 > bounds[-1]:
+            bounds.append(match.start() + 1)
+    bounds.append(len(data))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_range(data, fmt):
+    # Worker entry point: parses one range of the export into a DataFrame
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return build_frame(*parse_messages(data, fmt), fmt)
+
+
+def preprocess_parallel(data, workers=None, min_size=PARALLEL_MIN_SIZE, compact=False):
+    """
+    Parses a large export on several cores.
+
+    The export is cut into ranges aligned to message headers, each range is parsed in a
+    worker process and the frames are joined back in order. Inputs smaller than min_size,
+    or a single worker, fall back to preprocess.
+
+    Parameters:
+    - data (str or bytes): The full export; bytes are decoded as UTF-8 by the workers.
+    - workers (int, optional): Number of worker processes; defaults to the CPU count.
+    - min_size (int): Smallest input, in bytes or characters, that is parsed in parallel.
+    - compact (bool): Return the compact schema (see compact_schema).
+
+    Returns:
+    - pd.DataFrame: Same result as preprocess.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(data) < min_size:
+        return preprocess(data.decode('utf-8') if isinstance(data, bytes) else data, compact)
+
+    head = data[:SNIFF_SIZE]
+    fmt = detect_format(head.decode('utf-8', 'ignore') if isinstance(head, bytes) else head)
+    if fmt is None:
+        return preprocess(data.decode('utf-8') if isinstance(data, bytes) else data, compact)
+
+    # A few ranges per worker keeps the pool busy when message density varies across the chat
+    ranges = split_ranges(data, fmt, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        frames = list(executor.map(parse_range, [data[start:end] for start, end in ranges],
+                                   [fmt] * len(ranges)))
+
+    df = pd.concat(frames, ignore_index=True)
+    return compact_schema(df) if compact else df
+
+
+def concat_frames(frames):
+    # Joins parsed frames, merging differing categories so categorical columns stay categorical
+    frames = [frame for frame in frames if frame is not None]
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = pd.Index([])
+            for frame in frames:
+                if column in frame:
+                    categories = categories.append(frame[column].cat.categories.difference(categories))
+            ordered = frames[0][column].cat.ordered
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories, ordered=ordered)})
+                      if column in frame else frame for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def prefix_digest(fileobj, size, chunk_size=CHUNK_SIZE, digest=None, start=0):
+    # SHA-256 hash object of the first `size` bytes of a binary file handle; a hash object of the
+    # first `start` bytes can be passed to only read the bytes after them
+    digest = hashlib.sha256() if digest is None else digest.copy()
+    fileobj.seek(start)
+    size -= start
+    while size > 0:
+        chunk = fileobj.read(min(chunk_size, size))
+        if not chunk:
+            break
+        digest.update(chunk)
+        size -= len(chunk)
+    return digest
+
+
+def last_message(fileobj, window=1 << 16):
+    # Byte offset of the header of the last message in a binary file handle,
+    # with the number of messages parsed from that offset on
+    size = fileobj.seek(0, 2)
+    while True:
+        begin = max(0, size - window)
+        fileobj.seek(begin)
+        buffer = fileobj.read()
+        fmt = detect_format(buffer.decode('utf-8', 'ignore'))
+        cut = last_boundary(buffer, fmt) if fmt else None
+        # Offset 0 of a window is only known to start a line at the very start of the file
+        if cut is not None and (cut > 0 or begin == 0):
+            return begin + cut, len(parse_messages(buffer[cut:].decode('utf-8'), fmt)[0])
+        if begin == 0:
+            return 0, 0
+        window *= 2
+
+
+def ingest(fileobj, previous=None, compact=False, chunk_size=CHUNK_SIZE, parallel_min_size=PARALLEL_MIN_SIZE):
+    """
+    Parses a binary export, reusing a previous ingestion of an older export of the same chat.
+
+    Daily re-exports of a chat are a superset of the previous one. When the bytes before the
+    last message of the previous ingestion are unchanged (same SHA-256) and that message still
+    starts with the same timestamp, only the data from that message on is parsed and appended
+    to the previous frame. Otherwise the whole export is parsed, on several cores (see
+    preprocess_parallel) when it is at least parallel_min_size bytes long.
+
+    Parameters:
+    - fileobj: Binary, seekable file handle of the export.
+    - previous (dict, optional): State returned by an earlier call to ingest.
+    - compact (bool): Return the compact schema (see compact_schema).
+    - chunk_size (int): Number of bytes read at a time.
+    - parallel_min_size (int): Smallest export, in bytes, whose full parse runs in parallel.
+
+    Returns:
+    - dict: Ingestion state with
+      'df' (the parsed chat),
+      'added' (index of the first row parsed by this call),
+      'removed' (rows of the previous frame that were parsed again, or None),
+      'offset', 'digest', 'last_date' and 'tail_rows' (used by the next incremental call).
+    """
+    start = 0
+    prefix = None
+    if previous is not None and previous['offset']:
+        prefix = prefix_digest(fileobj, previous['offset'], chunk_size)
+        if prefix.hexdigest() == previous['digest']:
+            start = previous['offset']
+
+    size = fileobj.seek(0, 2)
+    fileobj.seek(start)
+    if not start and size >= parallel_min_size:
+        batches = [preprocess_parallel(fileobj.read(), min_size=parallel_min_size, compact=compact)]
+    else:
+        batches = list(preprocess_stream(fileobj, chunk_size))
+        if compact:
+            batches = [compact_schema(batch) for batch in batches]
+
+    head = removed = None
+    if start:
+        if not batches or batches[0]['message_date'].iloc[0] != previous['last_date']:
+            return ingest(fileobj, None, compact, chunk_size, parallel_min_size)
+        keep = len(previous['df']) - previous['tail_rows']
+        head, removed = previous['df'].iloc[:keep], previous['df'].iloc[keep:]
+
+    if head is None and not batches:
+        df = preprocess('', compact)
+    else:
+        df = concat_frames([head] + batches)
+
+    offset, tail_rows = last_message(fileobj)
+    return {
+        'df': df,
+        'added': 0 if head is None else len(head),
+        'removed': removed,
+        'offset': offset,
+        # The prefix verified above is extended with the new bytes instead of hashing the file again
+        'digest': prefix_digest(fileobj, offset, chunk_size, prefix if start else None, start).hexdigest(),
+        'last_date': df['message_date'].iloc[len(df) - tail_rows] if tail_rows else None,
+        'tail_rows': tail_rows,
+    }
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger('whatsapp_chat_analyzer.profiling')
+
+# Profiler collecting the stages run by the current thread, if any
+_local = threading.local()
+
+
+def current_rss():
+    # Resident memory of the process in bytes, or None where /proc is not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class Sampler:
+    """
+    Minimal sampling profiler: a background thread periodically records the innermost
+    frame of the profiled thread, and of any other threads doing its work.
+
+    Parameters:
+    - interval (float): Seconds between samples.
+    - threads (callable, optional): Returns the ids of further threads to sample, e.g. the
+      busy workers of a thread pool; called before every sample.
+    """
+
+    def __init__(self, interval=0.005, threads=None):
+        self.interval = interval
+        self.threads = threads
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id=None):
+        target = thread_id or threading.get_ident()
+
+        def sample():
+            while not self._stop.wait(self.interval):
+                targets = {target}
+                if self.threads is not None:
+                    targets.update(self.threads())
+                frames = sys._current_frames()
+                for ident in targets:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        code = frame.f_code
+                        self.samples[f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'] += 1
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def top(self, n=20):
+        """
+        Returns the most frequently sampled locations.
+
+        Returns:
+        - pd.DataFrame: 'Location', 'Samples' and 'Share' (of all samples) columns.
+        """
+        total = sum(self.samples.values()) or 1
+        rows = [(location, count, round(count / total * 100, 2)) for location, count in self.samples.most_common(n)]
+        return pd.DataFrame(rows, columns=['Location', 'Samples', 'Share'])
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, rows processed and memory delta for named stages.
+
+    CPU time is that of the thread running the stage, so stages running at the same time on
+    different threads (see use) are not charged for each other. The memory delta is the
+    process RSS and does include other threads. Stages with the same name are summed. Each
+    finished stage is also logged as a JSON line.
+
+    Parameters:
+    - sample (bool): Also run a Sampler on the thread that activates the profiler.
+    - threads (callable, optional): Ids of worker threads the Sampler also samples (see Sampler).
+    """
+
+    def __init__(self, sample=False, threads=None):
+        self.stages = {}
+        self.sampler = Sampler(threads=threads) if sample else None
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        # Make this the profiler that module-level stage() reports to on this thread
+        self._previous = getattr(_local, 'profiler', None)
+        _local.profiler = self
+        if self.sampler is not None:
+            self.sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.sampler is not None:
+            self.sampler.stop()
+        _local.profiler = self._previous
+        return False
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Measures the enclosed block. The yielded dict's 'rows' can be set once the count is known.
+        """
+        record = {'rows': rows}
+        memory = current_rss()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu, record['rows'],
+                     None if memory is None else current_rss() - memory)
+
+    def add(self, name, wall, cpu, rows=None, memory=None):
+        # Stages can finish on several threads at once (see use)
+        with self._lock:
+            totals = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'rows': None, 'memory': None})
+            totals['calls'] += 1
+            totals['wall'] += wall
+            totals['cpu'] += cpu
+            if rows is not None:
+                totals['rows'] = (totals['rows'] or 0) + rows
+            if memory is not None:
+                totals['memory'] = (totals['memory'] or 0) + memory
+        logger.info(json.dumps({'stage': name, 'wall': round(wall, 6), 'cpu': round(cpu, 6), 'rows': rows,
+                                'memory': memory}))
+
+    def metrics(self):
+        # Totals per stage, in the order the stages first ran
+        with self._lock:
+            return {name: dict(totals) for name, totals in self.stages.items()}
+
+    def report(self):
+        """
+        Returns the stage totals as a table.
+
+        Returns:
+        - pd.DataFrame: One row per stage with calls, wall and CPU milliseconds, rows and memory delta (MiB).
+        """
+        with self._lock:
+            stages = {name: dict(totals) for name, totals in self.stages.items()}
+        rows = [(name, totals['calls'], round(totals['wall'] * 1000, 1), round(totals['cpu'] * 1000, 1),
+                 totals['rows'], None if totals['memory'] is None else round(totals['memory'] / 2 ** 20, 1))
+                for name, totals in stages.items()]
+        return pd.DataFrame(rows, columns=['Stage', 'Calls', 'Wall (ms)', 'CPU (ms)', 'Rows', 'Memory (MiB)'])
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Measures the enclosed block with the profiler active on this thread; does nothing without one.
+
+    Usage:
+        with profiling.stage('parse') as record:
+            df = ...
+            record['rows'] = len(df)
+    """
+    profiler = getattr(_local, 'profiler', None)
+    if profiler is None:
+        yield {'rows': rows}
+        return
+    with profiler.stage(name, rows) as record:
+        yield record
+
+
+def current():
+    # Profiler active on this thread, or None
+    return getattr(_local, 'profiler', None)
+
+
+@contextmanager
+def use(profiler):
+    """
+    Reports the stages run by this thread to profiler, e.g. in a worker thread doing work for
+    the thread that owns the profiler. Passing None disables reporting.
+    """
+    previous = getattr(_local, 'profiler', None)
+    _local.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _local.profiler = previous
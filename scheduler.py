@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import profiling
+
+
+class AnalysisScheduler:
+    """
+    Runs analyses on a thread pool and stores their results in a ResultCache.
+
+    Submitting a key that is already cached returns a finished future, and submitting one that
+    is still pending or running returns the existing future, so every rerun of the app can
+    submit all of its analyses again without repeating work. Threads fit because the heavy
+    lifting happens in pandas and regex calls that share the parsed chat without copying it.
+
+    Parameters:
+    - results (cache.ResultCache): Cache the results are read from and written to.
+    - max_workers (int, optional): Number of worker threads (default: ThreadPoolExecutor's default).
+    """
+
+    def __init__(self, results, max_workers=None):
+        self.results = results
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis')
+        self._futures = {}
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def submit(self, key, compute):
+        """
+        Schedules compute for key unless its result is cached or already on its way.
+
+        Stages recorded by compute are reported to the profiler active on the submitting thread.
+
+        Parameters:
+        - key (hashable): Cache key of the result.
+        - compute (callable): Function called without arguments to produce the result.
+
+        Returns:
+        - concurrent.futures.Future: Future of the result.
+        """
+        sentinel = object()
+        value = self.results.get(key, sentinel)
+        if value is not sentinel:
+            future = Future()
+            future.set_result(value)
+            return future
+
+        profiler = profiling.current()
+
+        def run():
+            thread = threading.get_ident()
+            with self._lock:
+                self._running.add(thread)
+            try:
+                with profiling.use(profiler):
+                    return self.results.put(key, compute())
+            finally:
+                with self._lock:
+                    self._running.discard(thread)
+
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and not future.cancelled():
+                return future
+            future = self._futures[key] = self._executor.submit(run)
+        # Registered outside the lock, since the callback runs right away if the future is already done
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, future):
+        # Finished futures are dropped; their result now lives in the cache
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def active_threads(self):
+        # Ids of the worker threads running an analysis right now, e.g. for profiling.Sampler
+        with self._lock:
+            return list(self._running)
+
+    def cancel(self, futures):
+        # Cancels the futures that haven't started yet; running ones finish and are cached
+        for future in futures:
+            future.cancel()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
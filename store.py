@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import preprocessor
+
+# Columns the store is partitioned by; each (year, month) gets its own directory
+PARTITIONS = ['year', 'month_num']
+
+# Row groups are kept small enough that user/date statistics can skip most of a month
+ROW_GROUP_SIZE = 65536
+
+
+def save_chat(df, path, fmt='parquet', row_group_size=ROW_GROUP_SIZE):
+    """
+    Writes a preprocessed chat to a columnar dataset partitioned by year and month.
+
+    'user' and the other categorical columns are stored dictionary-encoded. Any dataset already
+    at the path is replaced as a whole: the new one is written next to it and swapped in.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame returned by preprocess (compact or default layout).
+    - path (str): Directory of the dataset.
+    - fmt (str): 'parquet' or 'feather' (Arrow IPC files).
+    - row_group_size (int): Maximum number of rows per row group (Parquet) or record batch (Feather).
+    """
+    df = preprocessor.compact_schema(df)
+    table = pa.Table.from_pandas(df.drop(columns=['date']), preserve_index=False)
+    if not pa.types.is_dictionary(table.schema.field('user').type):
+        table = table.set_column(table.schema.get_field_index('user'), 'user',
+                                 table.column('user').dictionary_encode())
+
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=os.path.basename(path) + '.')
+
+    ds.write_dataset(
+        table, staging, format=fmt,
+        partitioning=ds.partitioning(table.select(PARTITIONS).schema, flavor='hive'),
+        max_rows_per_group=row_group_size, min_rows_per_group=min(row_group_size, 1024),
+        existing_data_behavior='overwrite_or_ignore',
+        # Keeps messages sent in the same minute in export order within each partition
+        preserve_order=True,
+    )
+
+    # Months of an earlier save must not survive next to the new ones
+    if os.path.exists(path):
+        old = tempfile.mkdtemp(dir=parent, prefix=os.path.basename(path) + '.')
+        os.rename(path, os.path.join(old, 'dataset'))
+        os.rename(staging, path)
+        shutil.rmtree(old)
+    else:
+        os.rename(staging, path)
+
+
+def date_filter(start=None, end=None):
+    # Filter on message_date, plus the equivalent bounds on the partition columns so whole
+    # months outside the range are never opened
+    expression = None
+    for bound, before in ((start, False), (end, True)):
+        if bound is None:
+            continue
+        bound = pd.Timestamp(bound)
+        year, month = ds.field('year'), ds.field('month_num')
+        if before:
+            condition = (ds.field('message_date') < bound.to_pydatetime()) & (
+                (year < bound.year) | ((year == bound.year) & (month <= bound.month)))
+        else:
+            condition = (ds.field('message_date') >= bound.to_pydatetime()) & (
+                (year > bound.year) | ((year == bound.year) & (month >= bound.month)))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def load_chat(path, users=None, start=None, end=None, fmt='parquet'):
+    """
+    Loads a chat saved with save_chat, reading only the partitions and row groups that can
+    contain matching messages.
+
+    Parameters:
+    - path (str): Directory of the dataset.
+    - users (list of str, optional): Only load messages from these users.
+    - start (date-like, optional): Only load messages sent at or after this time.
+    - end (date-like, optional): Only load messages sent before this time.
+    - fmt (str): 'parquet' or 'feather', as passed to save_chat.
+
+    Returns:
+    - pd.DataFrame: The matching messages in chronological order, in the compact layout.
+    """
+    dataset = ds.dataset(path, format=fmt, partitioning='hive')
+
+    expression = date_filter(start, end)
+    if users is not None:
+        condition = ds.field('user').isin(list(users))
+        expression = condition if expression is None else expression & condition
+
+    df = dataset.to_table(filter=expression).to_pandas()
+
+    # Partition directories are not read in chronological order (month_num=10 sorts before 2)
+    df = df.sort_values('message_date', kind='stable', ignore_index=True)
+    df['date'] = df['message_date']
+    # Restore the column order of preprocess, followed by any extra columns such as link_count
+    columns = list(preprocessor.COLUMNS)
+    columns += [column for column in df.columns if column not in columns]
+    return preprocessor.compact_schema(df[columns])
+
+
+def exists(path):
+    # Whether a dataset has been saved at the path
+    return os.path.isdir(path) and any(name.startswith(PARTITIONS[0] + '=') for name in os.listdir(path))
@@ -0,0 +1,123 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+
+# Header layout of each export format supported by preprocessor.preprocess
+HEADERS = {
+    '24h': lambda t: f'{t:%d/%m/%y}, {t.hour:02d}:{t:%M} - ',
+    '12h': lambda t: f'{t:%d/%m/%Y}, {t.hour % 12 or 12}:{t:%M} {t:%p} - ',
+    'ios': lambda t: f'[{t:%d/%m/%y}, {t.hour % 12 or 12}:{t:%M:%S} {t:%p}] ',
+}
+
+# Placeholder written for an attachment that was left out of the export
+MEDIA = {
+    '24h': '<Media omitted>',
+    '12h': '<Media omitted>',
+    'ios': '‎image omitted',
+}
+
+WORDS = ['hello', 'ok', 'yes', 'no', 'bhai', 'kal', 'meeting', 'lunch', 'today', 'tomorrow', 'call', 'done', 'thanks',
+         'please', 'send', 'file', 'report', 'where', 'when', 'why', 'great', 'nice', 'lol', 'haha', 'sure', 'wait',
+         'coming', 'home', 'office', 'project', 'deadline', 'review', 'photo', 'party', 'match', 'game', 'movie']
+
+# Single code points as well as ZWJ, skin-tone, flag and keycap sequences
+EMOJIS = ['😂', '👍', '❤️', '🙏', '🔥', '😭', '🎉', '👍🏽', '👋🏿', '👨‍👩‍👧', '🧑‍💻', '🇮🇳', '#️⃣', '😊']
+
+LINKS = ['https://example.com/a', 'http://docs.example.org/page?id=42', 'www.example.net', 'example.io/x']
+
+
+def iter_messages(messages=10000, users=8, fmt='24h', multiline_ratio=0.05, media_ratio=0.05, link_ratio=0.03,
+                  emoji_ratio=0.1, seed=0, start=datetime(2019, 1, 1)):
+    """
+    Yields the lines of a synthetic WhatsApp export, one message at a time.
+
+    The output only depends on the arguments, so the same call always produces the same export.
+
+    Parameters:
+    - messages (int): Number of messages to generate.
+    - users (int): Number of chat members.
+    - fmt (str): Export format, one of '24h', '12h' and 'ios'.
+    - multiline_ratio (float): Share of messages spanning several lines.
+    - media_ratio (float): Share of messages that are omitted media.
+    - link_ratio (float): Share of messages containing a link.
+    - emoji_ratio (float): Share of messages containing emojis.
+    - seed (int): Seed of the random generator.
+    - start (datetime): Timestamp of the first message.
+
+    Returns:
+    - Generator of str, each a complete message ending with a newline.
+    """
+    rng = random.Random(seed)
+    header = HEADERS[fmt]
+    names = [f'User {i + 1}' for i in range(users)]
+    time = start
+
+    for _ in range(messages):
+        # Gaps are mostly short with the occasional quiet stretch
+        time += timedelta(seconds=int(rng.expovariate(1 / 600)) + 1)
+        if fmt != 'ios':
+            time = time.replace(second=0)
+        user = rng.choice(names)
+
+        if rng.random() < 0.01:
+            yield header(time) + f'{user} added {rng.choice(names)}\n'
+            continue
+
+        if rng.random() < media_ratio:
+            yield header(time) + f'{user}: {MEDIA[fmt]}\n'
+            continue
+
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        if rng.random() < link_ratio:
+            text += ' ' + rng.choice(LINKS)
+        if rng.random() < emoji_ratio:
+            text += ' ' + ''.join(rng.choice(EMOJIS) for _ in range(rng.randint(1, 3)))
+        if rng.random() < multiline_ratio:
+            text += '\n' + '\n'.join(' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+                                     for _ in range(rng.randint(1, 3)))
+        yield header(time) + f'{user}: {text}\n'
+
+
+def generate_chat(messages=10000, **options):
+    """
+    Generates a synthetic export as a single string (see iter_messages for the options).
+
+    Returns:
+    - str: The export, starting with the end-to-end encryption notice like real exports.
+    """
+    return 'Messages and calls are end-to-end encrypted.\n' + ''.join(iter_messages(messages, **options))
+
+
+def write_chat(path, messages=10000, batch=10000, **options):
+    # Writes the export in batches so multi-million message exports never sit in memory at once
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('Messages and calls are end-to-end encrypted.\n')
+        lines = []
+        for line in iter_messages(messages, **options):
+            lines.append(line)
+            if len(lines) == batch:
+                f.write(''.join(lines))
+                lines = []
+        f.write(''.join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic WhatsApp chat export.')
+    parser.add_argument('path', help='File to write the export to')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--format', dest='fmt', choices=sorted(HEADERS), default='24h')
+    parser.add_argument('--multiline-ratio', type=float, default=0.05)
+    parser.add_argument('--media-ratio', type=float, default=0.05)
+    parser.add_argument('--link-ratio', type=float, default=0.03)
+    parser.add_argument('--emoji-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_chat(args.path, args.messages, users=args.users, fmt=args.fmt, multiline_ratio=args.multiline_ratio,
+               media_ratio=args.media_ratio, link_ratio=args.link_ratio, emoji_ratio=args.emoji_ratio,
+               seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
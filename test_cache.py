@@ -0,0 +1,47 @@
+import logging
+
+import cache
+
+
+def test_lru_eviction_by_size():
+    results = cache.ResultCache(max_bytes=2500)
+    for key in 'abc':
+        results.put(key, b'x' * 1000)
+    assert 'a' not in results
+    assert results.get('b') is not None and results.get('c') is not None
+
+
+def test_over_budget_entry_is_not_cached(caplog):
+    results = cache.ResultCache(max_bytes=2500)
+    results.put('small', b'x' * 1000)
+    with caplog.at_level(logging.WARNING, logger='whatsapp_chat_analyzer.cache'):
+        value = results.put('chat', b'x' * 5000)
+
+    assert value == b'x' * 5000
+    assert 'chat' not in results
+    assert results.get('small') == b'x' * 1000
+    assert results.nbytes == cache.sizeof(b'x' * 1000)
+    assert 'over the limit' in caplog.text
+
+
+def test_over_budget_entry_is_kept_on_disk(tmp_path):
+    results = cache.ResultCache(max_bytes=2500, directory=str(tmp_path))
+    results.put('chat', b'x' * 5000)
+    results.put('result', b'x' * 1000)
+    assert results.get('chat') == b'x' * 5000
+    assert results.get('result') == b'x' * 1000
+
+
+def test_pinned_entries_are_not_evicted():
+    results = cache.ResultCache(max_bytes=2500)
+    results.put('chat', b'x' * 5000, pin=True)
+    results.put('ingestion', b'x' * 10, pin=True)
+    for key in 'abc':
+        results.put(key, b'x' * 1000)
+    assert results.get('chat') == b'x' * 5000
+    assert results.get('ingestion') == b'x' * 10
+    assert results.get('c') == b'x' * 1000
+
+    results.unpin('chat')
+    assert 'chat' not in results
+    assert results.get('ingestion') == b'x' * 10
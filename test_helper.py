@@ -0,0 +1,149 @@
+import re
+from functools import lru_cache
+
+import emoji
+import pandas as pd
+import pytest
+
+import helper
+import preprocessor
+import synthetic
+
+
+def test_count_links_matches_urlextract():
+    messages = pd.Series([
+        'ip 10.0.0.1/path',
+        'router at 192.168.1.1',
+        'admin panel on 1.2.3.4:8080/x',
+        'see https://example.com/a?b=c and http://x.io',
+        'www.google.com',
+        'mail me at someone@example.org',
+        'version 3.10 is out',
+        'v1.2.3.4',
+        'meet at 10.30',
+        'hello there',
+        '',
+        'ip 10.0.0.1/path',
+    ])
+    expected = [len(helper.extractor.find_urls(text)) for text in messages]
+    assert helper.count_links(messages).tolist() == expected
+    assert expected[0] == 1
+
+
+# Row-based versions of the analyses, as they were computed before the aggregate cube
+
+@lru_cache(maxsize=None)
+def find_urls(message):
+    return len(helper.extractor.find_urls(message))
+
+
+def rows(df, user):
+    return df if user == 'Overall' else df[df['user'] == user]
+
+
+def row_stats(df, user):
+    df = rows(df, user)
+    words = sum(len(message.split()) for message in df['message'])
+    media = sum(re.match(helper.MEDIA_PATTERN, message) is not None for message in df['message'])
+    links = sum(find_urls(message) for message in df['message'])
+    return len(df), words, media, links
+
+
+def row_emojis(df, user):
+    return sum(len(emoji.emoji_list(message)) for message in rows(df, user)['message'])
+
+
+@pytest.fixture(scope='module')
+def chat():
+    df = preprocessor.preprocess(synthetic.generate_chat(3000, users=4, seed=2))
+    helper.classify_messages(df)
+    return df, helper.build_cube(df)
+
+
+@pytest.mark.parametrize('user', ['Overall', 'User 1', 'group_notification'])
+def test_cube_helpers_match_rows(chat, user):
+    df, cube = chat
+    selected = rows(df, user)
+
+    assert helper.fetch_stats(user, df, cube) == row_stats(df, user)
+
+    monthly = helper.monthly_timeline(user, df, cube)
+    expected = selected.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
+    assert monthly[['year', 'month_num', 'month', 'message']].values.tolist() == expected.values.tolist()
+
+    daily = helper.daily_timeline(user, df, cube)
+    expected = selected.groupby('date').count()['message']
+    assert daily['date'].dt.date.tolist() == expected.index.tolist()
+    assert daily['message'].tolist() == expected.tolist()
+
+    assert helper.week_activity_map(user, df, cube).to_dict() == selected['day_name'].value_counts().to_dict()
+    assert helper.monthly_activity_map(user, df, cube).to_dict() == selected['month'].value_counts().to_dict()
+
+    heatmap = helper.activity_heatmap(user, df, cube)
+    expected = selected.pivot_table(index='day_name', columns='hour', values='message', aggfunc='count').fillna(0)
+    pd.testing.assert_frame_equal(heatmap, expected, check_dtype=False, check_names=False)
+
+
+@pytest.mark.parametrize('user', ['Overall', 'User 2'])
+def test_user_cube_bounds_match_mask(chat, user):
+    df, cube = chat
+    dates = df['message_date']
+    keys = ['user', 'date', 'hour']
+    counts = ['message', 'words', 'media', 'links']
+
+    for start, end in [(dates.iloc[500], dates.iloc[2500]), (dates.iloc[500], None), (None, dates.iloc[2500])]:
+        # Whole hours are answered from the cube by binary search, the exact times from the messages
+        hours = (None if start is None else start.floor('h'), None if end is None else end.ceil('h'))
+        assert helper.on_hour(hours[0]) and helper.on_hour(hours[1])
+        for bounds in (hours, (start, end)):
+            mask = pd.Series(True, index=df.index)
+            if bounds[0] is not None:
+                mask &= dates >= bounds[0]
+            if bounds[1] is not None:
+                mask &= dates < bounds[1]
+
+            result = helper.user_cube(user, df, cube, *bounds)
+            expected = helper.build_cube(rows(df[mask], user))
+            for frame in (result, expected):
+                frame['user'] = frame['user'].astype(str)
+            pd.testing.assert_frame_equal(result.sort_values(keys)[keys + counts].reset_index(drop=True),
+                                          expected.sort_values(keys)[keys + counts].reset_index(drop=True),
+                                          check_dtype=False)
+            assert helper.fetch_stats(user, df, cube, *bounds) == row_stats(df[mask], user)
+
+
+def test_compare_users_matches_per_user_results(chat):
+    df, cube = chat
+    comparison = helper.compare_users(df, cube, helper.count_emojis(df)).set_index('user')
+
+    users = sorted(df.loc[df['user'] != 'group_notification', 'user'].unique())
+    assert sorted(comparison.index) == users
+    total = (df['user'] != 'group_notification').sum()
+    for user in users:
+        row = comparison.loc[user]
+        messages, words, media, links = row_stats(df, user)
+        assert (row['messages'], row['words'], row['media'], row['links']) == (messages, words, media, links)
+        assert row['emojis'] == row_emojis(df, user)
+        assert row['percent'] == round(messages / total * 100, 2)
+
+        hours = rows(df, user)['hour'].value_counts()
+        assert row[[f'hour_{hour:02d}' for hour in range(24)]].tolist() == \
+            [round(hours.get(hour, 0) / messages * 100, 2) for hour in range(24)]
+        days = rows(df, user)['day_name'].value_counts()
+        assert row[preprocessor.DAYS].tolist() == [round(days.get(day, 0) / messages * 100, 2)
+                                                   for day in preprocessor.DAYS]
+
+
+def test_compare_users_latency():
+    df = preprocessor.preprocess(
+        '01/02/21, 10:00 - A: hi\n'
+        '01/02/21, 10:05 - B: hey\n'
+        '01/02/21, 10:06 - B: how are you\n'
+        '01/02/21, 10:16 - A: fine\n'
+        '01/02/21, 10:17 - A added C\n'
+        '01/02/21, 10:20 - B: good\n'
+    )
+    helper.classify_messages(df)
+    latency = helper.compare_users(df).set_index('user')['latency']
+    # A replied after 10 minutes; B after 5 and 4, the notification in between being ignored
+    assert latency.to_dict() == {'A': 10.0, 'B': 4.5}
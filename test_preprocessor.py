@@ -0,0 +1,98 @@
+import io
+
+import pandas as pd
+import pytest
+
+import helper
+import preprocessor
+import synthetic
+
+MESSAGES = 2000
+
+# Preamble generate_chat writes before the first message
+NOTICE = 'Messages and calls are end-to-end encrypted.\n'
+
+
+@pytest.fixture(scope='module', params=sorted(synthetic.HEADERS))
+def chat(request):
+    # Export lines of one synthetic chat per format, with the frame preprocess builds from them
+    lines = list(synthetic.iter_messages(MESSAGES, users=5, fmt=request.param, seed=1))
+    data = NOTICE + ''.join(lines)
+    return request.param, lines, data, preprocessor.preprocess(data)
+
+
+def test_timestamps_match_headers(chat):
+    fmt, lines, data, df = chat
+    assert len(df) == len(lines)
+    for line, stamp in zip(lines, df['message_date']):
+        assert line.startswith(synthetic.HEADERS[fmt](stamp.to_pydatetime()))
+
+
+@pytest.mark.parametrize('chunk_size', [997, 4096, 1 << 20])
+def test_preprocess_file_matches_preprocess(chat, chunk_size):
+    fmt, lines, data, df = chat
+    streamed = preprocessor.preprocess_file(io.BytesIO(data.encode('utf-8')), chunk_size=chunk_size)
+    pd.testing.assert_frame_equal(streamed, df)
+
+
+def test_preprocess_parallel_matches_preprocess(chat):
+    fmt, lines, data, df = chat
+    parallel = preprocessor.preprocess_parallel(data.encode('utf-8'), workers=2, min_size=0)
+    pd.testing.assert_frame_equal(parallel, df)
+
+
+def test_ingest_parallel_full_parse_matches_preprocess(chat):
+    fmt, lines, data, df = chat
+    state = preprocessor.ingest(io.BytesIO(data.encode('utf-8')), parallel_min_size=0)
+    pd.testing.assert_frame_equal(state['df'], df)
+    assert state['added'] == 0 and state['removed'] is None
+
+
+def test_compact_schema_keeps_values(chat):
+    fmt, lines, data, df = chat
+    compact = preprocessor.preprocess(data, compact=True)
+    assert list(compact.columns) == preprocessor.COLUMNS
+    pd.testing.assert_frame_equal(compact.astype(str), df.astype(str))
+
+
+def test_ingest_incremental_matches_full_parse(chat):
+    fmt, lines, data, df = chat
+    first = (NOTICE + ''.join(lines[:MESSAGES // 2])).encode('utf-8')
+
+    previous = preprocessor.ingest(io.BytesIO(first), compact=True)
+    helper.classify_messages(previous['df'], previous['added'])
+    previous['cube'] = helper.build_cube(previous['df'])
+    previous['words'] = helper.count_words(previous['df'])
+    previous['emojis'] = helper.count_emojis(previous['df'])
+
+    state = preprocessor.ingest(io.BytesIO(data.encode('utf-8')), previous, compact=True)
+    assert state['added'] > 0
+    helper.classify_messages(state['df'], state['added'])
+    pd.testing.assert_frame_equal(state['df'][preprocessor.COLUMNS].astype(str), df.astype(str))
+
+    full = preprocessor.preprocess(data, compact=True)
+    helper.classify_messages(full)
+    added = state['df'].iloc[state['added']:]
+
+    keys = ['user', 'date', 'hour']
+    cube = helper.update_cube(previous['cube'], added, state['removed'])
+    expected = helper.build_cube(full)
+    for frame in (cube, expected):
+        frame['user'] = frame['user'].astype(str)
+    pd.testing.assert_frame_equal(cube.sort_values(keys, ignore_index=True),
+                                  expected.sort_values(keys, ignore_index=True), check_like=True)
+
+    words = helper.update_word_counts(previous['words'], added, state['removed'])
+    pd.testing.assert_series_equal(words.sort_index(), helper.count_words(full).sort_index())
+    emojis = helper.update_emoji_counts(previous['emojis'], added, state['removed'])
+    pd.testing.assert_series_equal(emojis.sort_index(), helper.count_emojis(full).sort_index())
+
+
+def test_store_round_trip(chat, tmp_path):
+    pytest.importorskip('pyarrow')
+    import store
+
+    fmt, lines, data, df = chat
+    compact = preprocessor.preprocess(data, compact=True)
+    store.save_chat(compact, str(tmp_path), row_group_size=256)
+    pd.testing.assert_frame_equal(store.load_chat(str(tmp_path)), compact)
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+import preprocessor
+import synthetic
+
+pytest.importorskip('pyarrow')
+import store
+
+
+def chat(messages, year):
+    return preprocessor.preprocess(synthetic.generate_chat(messages, start=pd.Timestamp(year, 1, 1).to_pydatetime()),
+                                   compact=True)
+
+
+def test_saving_again_replaces_the_dataset(tmp_path):
+    path = str(tmp_path / 'chat')
+    store.save_chat(chat(500, 2019), path)
+    newer = chat(500, 2021)
+    store.save_chat(newer, path)
+
+    pd.testing.assert_frame_equal(store.load_chat(path), newer)
+    # No staging directories are left behind
+    assert list(tmp_path.iterdir()) == [tmp_path / 'chat']
+
+
+def test_filters(tmp_path):
+    df = chat(3000, 2019)
+    path = str(tmp_path / 'chat')
+    store.save_chat(df, path, row_group_size=256)
+
+    start, end = df['message_date'].iloc[1000], df['message_date'].iloc[2000]
+    users = ['User 1', 'User 2']
+    expected = df[(df['message_date'] >= start) & (df['message_date'] < end) & df['user'].isin(users)]
+    loaded = store.load_chat(path, users=users, start=start, end=end)
+    pd.testing.assert_frame_equal(loaded.astype(str), expected.reset_index(drop=True).astype(str))